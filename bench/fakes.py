@@ -0,0 +1,273 @@
+# Локальные заглушки всех внешних зависимостей бота для бенчмарка: GigaChat,
+# Telegram Bot API, Google Books, API библиотеки Сбербанка, DuckDuckGo и Google.
+# У каждой есть latency (секунды, с разбросом +-50%) и error_rate (0..1).
+import asyncio
+import json
+import random
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+import requests # type: ignore
+from requests.adapters import HTTPAdapter # type: ignore
+from aiogram.client.session.base import BaseSession # type: ignore
+from aiogram.methods import EditMessageText, GetChatMember, SendChatAction, SendMessage # type: ignore
+from langchain_core.language_models.chat_models import BaseChatModel # type: ignore
+from langchain_core.messages import AIMessage, HumanMessage # type: ignore
+from langchain_core.outputs import ChatGeneration, ChatResult # type: ignore
+from bot.admission import BUSY_REPLIES
+
+
+def _jitter(latency: float) -> float:
+    return latency * random.uniform(0.5, 1.5) if latency else 0
+
+
+def _fails(error_rate: float) -> bool:
+    return error_rate > 0 and random.random() < error_rate
+
+
+# Какой инструмент вызывает фейковая модель на первый вопрос, по агенту
+TOOL_PREFERENCE = ["get_books_universal_search", "find_books_sberbank"]
+# Из этих предложений состоит финальный ответ фейковой модели: по нему бенчмарк узнает ответ агента
+ANSWER_SENTENCE = "Рекомендую обратить внимание на эту книгу, она хорошо подходит под ваш запрос. "
+
+
+class FakeGigaChat(BaseChatModel):
+    """
+    Scripted GigaChat: a user question triggers one search tool call, a tool result triggers the final answer.
+
+    ``latency`` is spent on every model call, ``answer_chars`` sets the length
+    of the final answer (and thus of the Telegram messages).
+    """
+
+    latency: float = 0.5
+    error_rate: float = 0.0
+    answer_chars: int = 800
+    tool_names: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gigachat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tool_names": [tool.name for tool in tools]})
+
+    def get_num_tokens(self, text: str) -> int:
+        return round(len(text) / 4.6)
+
+    def _respond(self, messages) -> ChatResult:
+        if _fails(self.error_rate):
+            raise RuntimeError("GigaChat: 503 Service Unavailable")
+        last = messages[-1]
+        tool = next((name for name in TOOL_PREFERENCE if name in self.tool_names), None)
+        if isinstance(last, HumanMessage) and tool:
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": tool, "args": {"query": str(last.content)[-200:]}, "id": uuid.uuid4().hex}],
+            )
+        else:
+            sentence = ANSWER_SENTENCE
+            message = AIMessage(content=(sentence * (self.answer_chars // len(sentence) + 1))[:self.answer_chars])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(_jitter(self.latency))
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(_jitter(self.latency))
+        return self._respond(messages)
+
+
+class FakeUpstreams:
+    """
+    Fake Google Books and Sberbank library APIs behind the shared HTTP clients.
+
+    ``install()`` mounts a transport adapter on ``http_client.session`` and
+    replaces ``async_http_client.get_json``, so the real retry, circuit
+    breaker and cache code paths are exercised.
+    """
+
+    def __init__(self, latency: float = 0.15, error_rate: float = 0.0, books: int = 500, categories: int = 20):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.categories = [{"id": i, "name": f"Категория {i}"} for i in range(categories)]
+        self.books = [
+            {
+                "id": i,
+                "name": f"Книга номер {i}",
+                "author": f"Автор {i % 97}",
+                "category": self.categories[i % categories],
+                "isReserved": i % 3 == 0,
+                "description": f"Описание книги {i} о программировании, истории и фантастике. " * 5,
+            }
+            for i in range(books)
+        ]
+        self.stats = {"requests": 0, "errors": 0}
+
+    def respond(self, url: str, params: dict | None = None) -> tuple:
+        """Returns (status, payload) for a GET to ``url``."""
+        self.stats["requests"] += 1
+        if _fails(self.error_rate):
+            self.stats["errors"] += 1
+            return 503, {"error": {"code": 503, "message": "injected failure"}}
+        parts = urlsplit(url)
+        params = dict(params or {})
+        params.update({key: values[0] for key, values in parse_qs(parts.query).items()})
+        path = parts.path.rstrip("/")
+        if path.endswith("/books/v1/volumes"):
+            return 200, self._volumes(params.get("q", ""), int(params.get("startIndex", 0)), int(params.get("maxResults", 10)))
+        if path.endswith("/category/all"):
+            return 200, {"body": self.categories}
+        if path.endswith("/custom/api/v1/books"):
+            return 200, {"body": self.books}
+        if "/custom/api/v1/books/" in path + "/":
+            book_id = path.rsplit("/", 1)[-1]
+            if book_id.isdigit() and int(book_id) < len(self.books):
+                return 200, {"body": self.books[int(book_id)]}
+        return 404, {"error": {"code": 404, "message": "not found"}}
+
+    def _volumes(self, query: str, start: int, size: int) -> dict:
+        return {
+            "totalItems": 100,
+            "items": [
+                {
+                    "id": f"{query}-{start + i}",
+                    "volumeInfo": {
+                        "title": f"{query} — том {start + i}",
+                        "authors": [f"Автор {i}"],
+                        "publishedDate": "2020-01-01",
+                        "categories": ["Fiction"],
+                        "publisher": "Издательство",
+                        "description": "Длинное описание книги для проверки обрезки. " * 20,
+                        "infoLink": f"https://books.google.com/books?id={start + i}",
+                    },
+                    "saleInfo": {"buyLink": f"https://play.google.com/store/books/details?id={start + i}"},
+                }
+                for i in range(size)
+            ],
+        }
+
+    def install(self) -> None:
+        from service.http_client import async_http_client, http_client
+
+        upstreams = self
+
+        class Adapter(HTTPAdapter):
+            def send(self, request, **kwargs):
+                time.sleep(_jitter(upstreams.latency))
+                status, payload = upstreams.respond(request.url)
+                response = requests.Response()
+                response.status_code = status
+                response._content = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                response.headers["Content-Type"] = "application/json"
+                response.url = request.url
+                response.request = request
+                return response
+
+        adapter = Adapter()
+        http_client.session.mount("https://", adapter)
+        http_client.session.mount("http://", adapter)
+
+        async def get_json(url, params=None, headers=None):
+            await asyncio.sleep(_jitter(upstreams.latency))
+            return upstreams.respond(url, params)[1]
+
+        async_http_client.get_json = get_json
+
+
+class FakeDDGS:
+    """Stand-in for ``duckduckgo_search.DDGS``; shares latency/error settings via class attributes."""
+
+    latency = 0.3
+    error_rate = 0.0
+
+    def text(self, query, max_results=5, **kwargs):
+        time.sleep(_jitter(self.latency))
+        if _fails(self.error_rate):
+            raise RuntimeError("202 Ratelimit")
+        return [
+            {"title": f"{query} — результат {i}", "href": f"https://ozon.ru/product/{i}", "body": "Купить книгу"}
+            for i in range(max_results)
+        ]
+
+
+def install_search_fakes(latency: float = 0.3, error_rate: float = 0.0) -> None:
+    import service.duckduck_search as duckduck_search
+
+    FakeDDGS.latency = latency
+    FakeDDGS.error_rate = error_rate
+    duckduck_search.DDGS = FakeDDGS
+    duckduck_search.search_google = lambda query, site=None, status=None: [f"https://www.google.com/search?q={i}" for i in range(3)]
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    aiogram session that answers Bot API calls locally.
+
+    Sent and edited messages are counted per chat; ``first_reply`` keeps the
+    time of the first message sent to a chat since the last ``reset(chat_id)``,
+    which the runner uses as time-to-first-response, and ``last_text`` the
+    latest text the chat saw (to check that the turn got an agent answer).
+    """
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"calls": 0, "sent": 0, "edits": 0, "errors_shown": 0, "busy_shown": 0, "failed_calls": 0}
+        self.first_reply: dict = {}
+        self.last_text: dict = {}
+        self._message_id = 0
+
+    def reset(self, chat_id: int) -> None:
+        self.first_reply.pop(chat_id, None)
+        self.last_text.pop(chat_id, None)
+
+    def _message(self, chat_id: int, text: str, message_id: int | None = None) -> dict:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 42, "is_bot": True, "first_name": "BookExpert"},
+            "text": text,
+        }
+
+    async def make_request(self, bot, method, timeout=None):
+        self.stats["calls"] += 1
+        await asyncio.sleep(_jitter(self.latency))
+        if _fails(self.error_rate):
+            self.stats["failed_calls"] += 1
+            content = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                       "parameters": {"retry_after": 1}}
+            return self.check_response(bot, method, 429, json.dumps(content)).result
+
+        if isinstance(method, SendMessage):
+            self.stats["sent"] += 1
+            self.first_reply.setdefault(method.chat_id, time.perf_counter())
+            self.last_text[method.chat_id] = method.text
+            if method.text.startswith("Произошла ошибка"):
+                self.stats["errors_shown"] += 1
+            elif method.text in BUSY_REPLIES.values():
+                self.stats["busy_shown"] += 1
+            result = self._message(method.chat_id, method.text)
+        elif isinstance(method, EditMessageText):
+            self.stats["edits"] += 1
+            self.last_text[method.chat_id] = method.text
+            result = self._message(method.chat_id, method.text, method.message_id)
+        elif isinstance(method, GetChatMember):
+            result = {"status": "member", "user": {"id": method.user_id, "is_bot": False, "first_name": "User"}}
+        elif isinstance(method, SendChatAction):
+            result = True
+        else:
+            result = True
+        return self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result})).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError("File downloads are not faked")
+        yield b""
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import resource
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from langgraph.checkpoint.memory import MemorySaver # type: ignore
+from aiogram import Bot # type: ignore
+from aiogram.types import Update # type: ignore
+from bench.fakes import ANSWER_SENTENCE, FakeGigaChat, FakeTelegramSession, FakeUpstreams, install_search_fakes
+from bot.admission import BUSY_REPLIES
+from monitoring.tracing import TelegramRequestTiming
+
+# Сценарий: какой агент, режим ответа, вопросы пользователей и сбои внешних сервисов
+SCENARIOS = {
+    "llm": {"command": "/new", "stream": False},
+    "llm-stream": {"command": "/new", "stream": True},
+    "sberbank": {"command": "/sber_new", "stream": False},
+    "answer-cache": {"command": "/new", "stream": False, "same_question": True, "stagger": 0.2},
+    "flaky": {"command": "/new", "stream": False, "llm_error_rate": 0.05, "upstream_error_rate": 0.2},
+}
+
+# Корпоративный чат бенчмарка: проверка членства уходит в FakeTelegramSession
+BENCH_CHAT_ID = "-1000000000042"
+
+QUESTIONS = [
+    "Посоветуй фантастику про космос",
+    "Что почитать по Python для начинающих",
+    "Хочу детектив в стиле Агаты Кристи",
+    "Книги по истории Древнего Рима",
+    "Посоветуй что-нибудь по психологии",
+]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    """Синтетический апдейт Telegram с личным сообщением пользователя."""
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        },
+    })
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "p50": round(percentile(values, 0.50), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values, default=0.0), 3),
+    }
+
+
+async def run_scenario(name: str, args) -> dict:
+    import main
+    from bot.admission import AdmissionController
+    from bot.sessions import MemorySessionStore
+    from llm.answer_cache import answer_cache
+    from llm.registry import registry
+    from service.duckduck_search import ddg_search
+    from service.googlebooks import books_cache
+    from service.knowledge_base import knowledge_base
+    from service.sberbank_catalog import catalog
+
+    scenario = SCENARIOS[name]
+    upstreams = FakeUpstreams(latency=args.upstream_latency, error_rate=scenario.get("upstream_error_rate", 0.0))
+    upstreams.install()
+    install_search_fakes(latency=args.upstream_latency, error_rate=scenario.get("upstream_error_rate", 0.0))
+    session = FakeTelegramSession(latency=args.telegram_latency)
+    bot = Bot(token="42:BENCH", session=session)
+    bot.session.middleware(TelegramRequestTiming())
+    model = FakeGigaChat(latency=args.llm_latency, error_rate=scenario.get("llm_error_rate", 0.0))
+
+    registry.close()
+    registry.start(checkpointer=MemorySaver(), model=model)
+    main.bot = bot
+    # Без CORPORATE_CHAT_ID проверка доступа отвечает "Доступ запрещён" на каждый вопрос; членство фейковая сессия подтверждает всегда
+    main.access.corporate_chat_id = BENCH_CHAT_ID
+    main.sessions = MemorySessionStore()
+    # Лимиты частоты считаются заново: иначе пользователи прошлых сценариев упираются в них сразу
+    main.admission = AdmissionController()
+    main.STREAM_RESPONSES = scenario["stream"]
+    main.DB_POOL_ASYNC = False
+    books_cache.clear()
+    ddg_search.cache.clear()
+    answer_cache.clear()
+    # База книг у каждого сценария своя и в памяти, чтобы не трогать файл бота
+    knowledge_base.open(":memory:")
+    catalog.refresh()
+    knowledge_base.ingest_sberbank(catalog.books)
+
+    latencies, first_replies, unanswered = [], [], []
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def user(user_id: int) -> None:
+        # Пользователи приходят с интервалом stagger, иначе все первые вопросы промахиваются мимо кэша
+        await asyncio.sleep((user_id - 1000) * scenario.get("stagger", 0))
+        await main.dp.feed_update(bot, make_update(next(update_ids), user_id, scenario["command"]))
+        for i in range(args.messages):
+            question = QUESTIONS[0 if scenario.get("same_question") else (user_id + i) % len(QUESTIONS)]
+            session.reset(user_id)
+            started = time.perf_counter()
+            await main.dp.feed_update(bot, make_update(next(update_ids), user_id, question))
+            latencies.append(time.perf_counter() - started)
+            if user_id in session.first_reply:
+                first_replies.append(session.first_reply[user_id] - started)
+            reply = session.last_text.get(user_id) or ""
+            # Ошибка и "занято" - честный исход хода (их считают errors/busy), все остальное - сломанный прогон
+            if ANSWER_SENTENCE.strip() not in reply and not reply.startswith("Произошла ошибка") \
+                    and reply not in BUSY_REPLIES.values():
+                unanswered.append(reply)
+
+    cache_stats = dict(answer_cache.stats)
+    tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user(1000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if unanswered:
+        raise RuntimeError(f"{name}: {len(unanswered)} of {len(latencies)} turns got no agent answer, "
+                           f"last reply: {unanswered[-1][:100]!r}")
+
+    return {
+        "scenario": name,
+        "users": args.users,
+        "messages": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_s": summarize(latencies),
+        "first_reply_s": summarize(first_replies),
+        "errors_shown": session.stats["errors_shown"],
+        "busy_shown": session.stats["busy_shown"],
+        "telegram": session.stats,
+        "upstream": upstreams.stats,
+        "executor": main.executor.stats(),
+        "answer_cache": {key: value - cache_stats[key] for key, value in answer_cache.stats.items()},
+        "peak_traced_mb": round(peak / 2 ** 20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def print_report(result: dict) -> None:
+    latency, first = result["latency_s"], result["first_reply_s"]
+    print(
+        f"{result['scenario']:<14} msgs={result['messages']:<5} "
+        f"thr={result['throughput_msg_s']:>7}/s  "
+        f"p50={latency['p50']:.3f} p95={latency['p95']:.3f} p99={latency['p99']:.3f}  "
+        f"first p50={first['p50']:.3f}  errors={result['errors_shown']} busy={result['busy_shown']}  "
+        f"cache hits={result['answer_cache']['hits']}  "
+        f"peak={result['peak_traced_mb']}MB rss={result['max_rss_mb']}MB"
+    )
+
+
+async def amain(args) -> None:
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        result = await run_scenario(name, args)
+        print_report(result)
+        results.append(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"started_at": datetime.now(timezone.utc).isoformat(), "results": results}, f,
+                      ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the bot against local fakes")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario to run (repeatable); all by default")
+    parser.add_argument("--users", type=int, default=20, help="concurrent users")
+    parser.add_argument("--messages", type=int, default=3, help="questions per user")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per GigaChat call")
+    parser.add_argument("--upstream-latency", type=float, default=0.15, help="seconds per Google Books/Sberbank/DDG call")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument("--output", help="write full results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(amain(parse_args()))
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from settings import settings
+from monitoring.tracing import span
+from service.http_client import TokenBucket
+
+
+# Частота вопросов одного пользователя: всплеск до USER_BURST, дальше USER_RATE в секунду
+ADMISSION_USER_RATE = settings.get_float("ADMISSION_USER_RATE", 0.2)
+ADMISSION_USER_BURST = settings.get_float("ADMISSION_USER_BURST", 3)
+# Сколько ответов агента идет одновременно, подбирается под квоту GigaChat
+ADMISSION_MAX_IN_FLIGHT = settings.get_int("ADMISSION_MAX_IN_FLIGHT", settings.get_int("AGENT_MAX_CONCURRENCY",
+                                                                                   settings.get_int("AGENT_WORKERS", 8)))
+ADMISSION_MAX_QUEUE = settings.get_int("ADMISSION_MAX_QUEUE", 100)
+ADMISSION_MAX_WAIT = settings.get_float("ADMISSION_MAX_WAIT", 60)
+ADMISSION_COALESCE_MAX = settings.get_int("ADMISSION_COALESCE_MAX", 5)
+
+BUSY_REPLIES = {
+    "rate": "⏳ Вы отправляете сообщения слишком часто. Подождите немного и повторите вопрос.",
+    "queue": "⏳ Сейчас очень много запросов. Пожалуйста, повторите вопрос через минуту.",
+    "timeout": "⏳ Сейчас очень много запросов, и бот не успел взяться за ваш вопрос. Пожалуйста, повторите его через минуту.",
+}
+
+
+class AdmissionRejected(Exception):
+    """Вопрос не принят в работу; ``reason`` - ключ BUSY_REPLIES."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Turn:
+    """Один ход агента: вопрос пользователя и дописанные к нему сообщения, пришедшие, пока ход ждал очереди."""
+
+    def __init__(self, user_id: int, text: str):
+        self.user_id = user_id
+        self.texts = [text]
+        self.created_at = time.perf_counter()
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+
+class AdmissionController:
+    """
+    Допуск вопросов к агенту: лимит частоты на пользователя, общий лимит
+    одновременных ответов и справедливая очередь между пользователями.
+
+    У пользователя одновременно не больше одного хода в работе и одного в
+    очереди. Сообщения, пришедшие, пока ход ждет, дописываются к нему и
+    обрабатываются одним ответом агента. Свободный слот достается следующему
+    пользователю по кругу, поэтому один активный пользователь не задерживает
+    остальных. Если очередь переполнена или ход ждет дольше ``max_wait``,
+    вопрос отклоняется (AdmissionRejected), и бот вежливо просит повторить.
+    """
+
+    def __init__(self, user_rate: float = ADMISSION_USER_RATE, user_burst: float = ADMISSION_USER_BURST,
+                 max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT, coalesce_max: int = ADMISSION_COALESCE_MAX,
+                 max_users: int = 10000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.coalesce_max = coalesce_max
+        self.max_users = max_users
+        self.stats = {"admitted": 0, "coalesced": 0, "shed_rate": 0, "shed_queue": 0, "shed_timeout": 0}
+        self._buckets: OrderedDict = OrderedDict()
+        self._active: set = set()
+        self._pending: dict = {}
+        # Пользователи, чей ход может стартовать прямо сейчас, по порядку прихода
+        self._ready: deque = deque()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._active)
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            # Вытесняемые корзины давно не трогали, и они успели наполниться
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+        return bucket
+
+    def submit(self, user_id: int, text: str) -> Turn | None:
+        """
+        Ставит сообщение в очередь.
+
+        Returns:
+            Turn | None: Новый ход или None, если сообщение дописано к уже ждущему ходу пользователя.
+
+        Raises:
+            AdmissionRejected: Превышен лимит частоты пользователя или переполнена очередь.
+        """
+        pending = self._pending.get(user_id)
+        if pending is not None and len(pending.texts) < self.coalesce_max:
+            pending.texts.append(text)
+            self.stats["coalesced"] += 1
+            return None
+        if pending is not None or not self._bucket(user_id).try_acquire():
+            self.stats["shed_rate"] += 1
+            raise AdmissionRejected("rate")
+        if len(self._pending) >= self.max_queue:
+            self.stats["shed_queue"] += 1
+            raise AdmissionRejected("queue")
+
+        turn = Turn(user_id, text)
+        self._pending[user_id] = turn
+        if user_id not in self._active:
+            self._ready.append(user_id)
+        self._dispatch()
+        return turn
+
+    def _dispatch(self) -> None:
+        while self._ready and len(self._active) < self.max_in_flight:
+            user_id = self._ready.popleft()
+            turn = self._pending.pop(user_id)
+            self._active.add(user_id)
+            self.stats["admitted"] += 1
+            turn.granted.set_result(True)
+
+    async def wait(self, turn: Turn) -> None:
+        """Ждет слота для хода; по истечении max_wait снимает ход с очереди и бросает AdmissionRejected."""
+        timeout = self.max_wait - (time.perf_counter() - turn.created_at)
+        try:
+            await asyncio.wait_for(asyncio.shield(turn.granted), max(0, timeout))
+        except asyncio.TimeoutError:
+            if turn.granted.done():
+                return
+            self._withdraw(turn)
+            self.stats["shed_timeout"] += 1
+            raise AdmissionRejected("timeout")
+        except asyncio.CancelledError:
+            if turn.granted.done():
+                self.release(turn)
+            else:
+                self._withdraw(turn)
+            raise
+
+    def _withdraw(self, turn: Turn) -> None:
+        if self._pending.get(turn.user_id) is turn:
+            del self._pending[turn.user_id]
+            try:
+                self._ready.remove(turn.user_id)
+            except ValueError:
+                pass
+
+    def release(self, turn: Turn) -> None:
+        """Освобождает слот; ждущий ход того же пользователя встает в конец круга."""
+        self._active.discard(turn.user_id)
+        if turn.user_id in self._pending:
+            self._ready.append(turn.user_id)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, user_id: int, text: str):
+        """
+        ``async with admission.admit(user_id, text) as turn:`` - ход агента в пределах лимитов.
+
+        ``turn`` равен None, если сообщение дописано к другому ходу: отвечать на него не нужно.
+        """
+        turn = self.submit(user_id, text)
+        if turn is None:
+            yield None
+            return
+        with span("admission"):
+            await self.wait(turn)
+        try:
+            yield turn
+        finally:
+            self.release(turn)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, in_flight=self.in_flight, queued=self.queued)
+
+
+admission = AdmissionController()
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import OrderedDict
+from psycopg.types.json import Jsonb # type: ignore
+from settings import settings
+from llm.checkpointer import checkpointer_pool
+
+
+SESSION_BACKEND = settings.get("SESSION_BACKEND", "postgres").lower()
+SESSION_TTL = settings.get_float("SESSION_TTL", 24 * 3600 * 14)
+SESSION_MAX_USERS = settings.get_int("SESSION_MAX_USERS", 10000)
+
+CREATE_SESSIONS_SQL = """
+CREATE TABLE IF NOT EXISTS bot_sessions (
+    user_id BIGINT PRIMARY KEY,
+    data JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+GET_SESSION_SQL = """
+SELECT data FROM bot_sessions
+WHERE user_id = %(user_id)s AND updated_at > now() - make_interval(secs => %(ttl)s)
+"""
+
+# set заменяет сессию целиком, update сливает поля в одном атомарном UPSERT
+SET_SESSION_SQL = """
+INSERT INTO bot_sessions (user_id, data, updated_at) VALUES (%(user_id)s, %(data)s, now())
+ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = now()
+"""
+
+UPDATE_SESSION_SQL = """
+INSERT INTO bot_sessions (user_id, data, updated_at) VALUES (%(user_id)s, %(data)s, now())
+ON CONFLICT (user_id) DO UPDATE SET data = bot_sessions.data || EXCLUDED.data, updated_at = now()
+RETURNING data
+"""
+
+DELETE_SESSION_SQL = "DELETE FROM bot_sessions WHERE user_id = %(user_id)s"
+
+PURGE_SESSIONS_SQL = """
+DELETE FROM bot_sessions WHERE updated_at < now() - make_interval(secs => %(ttl)s)
+"""
+
+
+def new_session(user_id: int, timestamp: int, message_id: int, agent_type: str = "default") -> dict:
+    """Новая сессия диалога: свой thread_id для чекпоинтера, выбранный агент и число отвеченных вопросов."""
+    return {
+        "thread_id": f"{user_id}_{timestamp}",
+        "last_message_id": message_id,
+        "agent_type": agent_type,
+        "turns": 0,
+    }
+
+
+class MemorySessionStore:
+    """
+    Сессии пользователей в памяти процесса.
+
+    Размер ограничен ``maxsize`` (вытесняется давно не писавший пользователь),
+    сессия без активности дольше ``ttl`` секунд считается истекшей. Подходит
+    для одной реплики и локального запуска: после рестарта сессии теряются.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, maxsize: int = SESSION_MAX_USERS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    async def start(self) -> None:
+        pass
+
+    async def get(self, user_id: int) -> dict | None:
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        session, updated_at = entry
+        if time.monotonic() - updated_at > self.ttl:
+            del self._data[user_id]
+            return None
+        return dict(session)
+
+    async def set(self, user_id: int, session: dict) -> None:
+        self._data[user_id] = (dict(session), time.monotonic())
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def update(self, user_id: int, **fields) -> dict:
+        """Сливает поля в сессию; без await внутри, поэтому атомарно для event loop."""
+        entry = self._data.get(user_id)
+        session = dict(entry[0]) if entry else {}
+        session.update(fields)
+        await self.set(user_id, session)
+        return session
+
+    async def delete(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    async def purge(self) -> int:
+        now = time.monotonic()
+        expired = [user_id for user_id, (_, updated_at) in self._data.items() if now - updated_at > self.ttl]
+        for user_id in expired:
+            del self._data[user_id]
+        return len(expired)
+
+
+class PostgresSessionStore:
+    """
+    Сессии пользователей в таблице ``bot_sessions`` общего Postgres.
+
+    Использует пул соединений чекпоинтера (sync или async), поэтому сессии
+    переживают рестарт и видны всем репликам бота. ``update`` выполняется
+    одним UPSERT с JSONB-слиянием, так что параллельные обновления с разных
+    реплик не затирают друг друга. Истекшие по ``ttl`` сессии не читаются и
+    удаляются через ``purge``.
+    """
+
+    def __init__(self, pool=checkpointer_pool, ttl: float = SESSION_TTL):
+        self.pool = pool
+        self.ttl = ttl
+
+    async def _execute(self, sql: str, params: dict | None = None, fetch: bool = False):
+        if self.pool.is_async:
+            async with self.pool.pool.connection() as conn:
+                cursor = await conn.execute(sql, params)
+                return await cursor.fetchone() if fetch else cursor.rowcount
+
+        def run():
+            with self.pool.pool.connection() as conn:
+                cursor = conn.execute(sql, params)
+                return cursor.fetchone() if fetch else cursor.rowcount
+
+        return await asyncio.to_thread(run)
+
+    async def start(self) -> None:
+        await self._execute(CREATE_SESSIONS_SQL)
+
+    async def get(self, user_id: int) -> dict | None:
+        row = await self._execute(GET_SESSION_SQL, {"user_id": user_id, "ttl": self.ttl}, fetch=True)
+        return row["data"] if row else None
+
+    async def set(self, user_id: int, session: dict) -> None:
+        await self._execute(SET_SESSION_SQL, {"user_id": user_id, "data": Jsonb(session)})
+
+    async def update(self, user_id: int, **fields) -> dict:
+        row = await self._execute(UPDATE_SESSION_SQL, {"user_id": user_id, "data": Jsonb(fields)}, fetch=True)
+        return row["data"]
+
+    async def delete(self, user_id: int) -> None:
+        await self._execute(DELETE_SESSION_SQL, {"user_id": user_id})
+
+    async def purge(self) -> int:
+        return await self._execute(PURGE_SESSIONS_SQL, {"ttl": self.ttl})
+
+
+def create_session_store(backend: str = SESSION_BACKEND):
+    """Хранилище сессий по SESSION_BACKEND: ``postgres`` (по умолчанию) или ``memory``."""
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "postgres":
+        return PostgresSessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter # type: ignore
+from aiogram.types import Message # type: ignore
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Статусы, которые видит пользователь, пока агент вызывает инструменты
+TOOL_STATUSES = {
+    "get_books_by_genre": "🔎 Ищу книги по жанру...",
+    "get_books_universal_search": "🔎 Ищу книги...",
+    "get_link_on_book": "🛒 Ищу, где купить книгу...",
+    "get_links_to_additional_information": "🌐 Ищу дополнительную информацию...",
+    "get_books_sberbank": "📚 Смотрю каталог библиотеки Сбербанка...",
+    "search_books_sberbank": "📚 Ищу в библиотеке Сбербанка...",
+    "find_books_sberbank": "📚 Ищу в библиотеке Сбербанка...",
+    "get_genres_of_sberbank": "📚 Смотрю жанры библиотеки Сбербанка...",
+    "check_book_sberbank": "📚 Проверяю, свободна ли книга в библиотеке Сбербанка...",
+    "new_available_books_sberbank": "📚 Ищу книги, которые недавно освободились в библиотеке Сбербанка...",
+}
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Делит текст на части не длиннее limit, стараясь резать по абзацам, строкам и пробелам."""
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+async def send_answer(message: Message, text: str) -> Message:
+    """Отправляет готовый ответ (с Markdown, если он корректен), деля его на части; возвращает последнее сообщение."""
+    for part in split_message(text):
+        try:
+            sent = await message.answer(part, parse_mode="Markdown")
+        except TelegramBadRequest:
+            # Если Markdown разметка некорректна, отправляем как обычный текст
+            sent = await message.answer(part)
+    return sent
+
+
+class StreamingReply:
+    """
+    Ответ, который постепенно дописывается в одно сообщение Telegram.
+
+    Сначала отправляется заглушка, затем она редактируется по мере
+    поступления токенов, но не чаще одного раза в ``min_interval`` секунд
+    (ограничения Telegram на редактирование). Во время вызова инструментов
+    показывается статус. Финальный ответ длиннее 4096 символов делится на
+    несколько сообщений.
+
+    Args:
+        message: Сообщение пользователя, на которое отвечаем.
+        min_interval: Минимальный интервал между редактированиями в секундах.
+    """
+
+    def __init__(self, message: Message, min_interval: float = 1.0):
+        self.message = message
+        self.min_interval = min_interval
+        self.sent = None
+        self.text = ""
+        self.status = "⏳ Думаю..."
+        self._shown = None
+        self._last_edit = 0.0
+
+    async def start(self) -> None:
+        self.sent = await self.message.answer(self.status)
+        self._shown = self.status
+        self._last_edit = time.monotonic()
+
+    def _render(self) -> str:
+        if not self.text:
+            return self.status
+        # Во время стриминга показываем хвост, если текст уже не помещается
+        text = self.text[-(TELEGRAM_MESSAGE_LIMIT - 2):]
+        return text + " ▌"
+
+    async def _edit(self, text: str, parse_mode=None, force: bool = False) -> None:
+        if text == self._shown:
+            return
+        if not force and time.monotonic() - self._last_edit < self.min_interval:
+            return
+        try:
+            await self.sent.edit_text(text, parse_mode=parse_mode)
+        except TelegramRetryAfter as e:
+            if not force:
+                return
+            await asyncio.sleep(e.retry_after)
+            await self.sent.edit_text(text, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+    async def append(self, token: str) -> None:
+        self.text += token
+        await self._edit(self._render())
+
+    async def reset(self) -> None:
+        self.text = ""
+
+    async def set_status(self, status: str) -> None:
+        self.status = status
+        if not self.text:
+            await self._edit(self._render())
+
+    async def finish(self, text: str) -> Message:
+        """Показывает финальный ответ (с Markdown, если он корректен) и возвращает последнее сообщение."""
+        parts = split_message(text or "🤷 Не удалось получить ответ.")
+        last = self.sent
+        for i, part in enumerate(parts):
+            try:
+                if i == 0:
+                    await self._edit(part, parse_mode="Markdown", force=True)
+                else:
+                    last = await self.message.answer(part, parse_mode="Markdown")
+            except TelegramBadRequest:
+                # Если Markdown разметка некорректна, отправляем как обычный текст
+                if i == 0:
+                    await self._edit(part, force=True)
+                else:
+                    last = await self.message.answer(part)
+        return last
+
+
+async def stream_reply(message: Message, events) -> tuple:
+    """
+    Отвечает пользователю, потребляя события агента из llm.streaming.astream_agent.
+
+    Returns:
+        tuple: Последнее отправленное сообщение с ответом и полный текст ответа.
+    """
+    reply = StreamingReply(message)
+    await reply.start()
+    final = ""
+    async for kind, payload in events:
+        if kind == "token":
+            await reply.append(payload)
+        elif kind == "reset":
+            await reply.reset()
+        elif kind == "tool_start":
+            await reply.set_status(TOOL_STATUSES.get(payload, "🔧 Работаю над запросом..."))
+        elif kind == "final":
+            final = payload
+    return await reply.finish(final), final
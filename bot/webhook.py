@@ -0,0 +1,192 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import queue
+import signal
+from aiohttp import web # type: ignore
+from monitoring.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_STOP = None
+
+
+def update_user_id(update: dict) -> int:
+    """
+    Достает id пользователя из сырого апдейта Telegram.
+
+    У сообщений, колбэков и прочих апдейтов отправитель лежит в поле
+    ``from``; если его нет (посты каналов), берется id чата. В chat_member и
+    my_chat_member ``from`` - администратор, поэтому они уходят к воркеру
+    участника, чей статус изменился: там лежит его кэш членства.
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        member = (value.get("new_chat_member") or {}).get("user") or {}
+        if "id" in member:
+            return member["id"]
+        sender = value.get("from") or value.get("user") or value.get("chat") or {}
+        if "id" in sender:
+            return sender["id"]
+    return 0
+
+
+def route(update: dict, workers: int) -> int:
+    """Номер воркера для апдейта: все апдейты одного пользователя попадают в один процесс."""
+    return update_user_id(update) % workers
+
+
+class WebhookFront:
+    """
+    aiohttp-приемник вебхуков Telegram, раздающий апдейты процессам-воркерам.
+
+    Апдейт сразу подтверждается и кладется в ограниченную очередь своего
+    воркера (по id пользователя). Если очередь заполнена или идет остановка,
+    отвечаем 503, и Telegram повторит доставку позже.
+
+    Args:
+        queues: Очереди воркеров (multiprocessing.Queue).
+        path: Путь вебхука.
+        secret: Ожидаемый заголовок X-Telegram-Bot-Api-Secret-Token или None.
+    """
+
+    def __init__(self, queues: list, path: str = "/webhook", secret: str | None = None):
+        self.queues = queues
+        self.path = path
+        self.secret = secret
+        self.draining = False
+        self.stats = {"received": 0, "rejected": 0, "forbidden": 0}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, self.secret):
+                self.stats["forbidden"] += 1
+                return web.Response(status=403)
+        if self.draining:
+            self.stats["rejected"] += 1
+            return web.Response(status=503)
+        update = await request.json()
+        try:
+            self.queues[route(update, len(self.queues))].put_nowait(update)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            return web.Response(status=503)
+        self.stats["received"] += 1
+        return web.Response()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+
+async def consume(updates, handle_update, max_pending: int = 100) -> None:
+    """
+    Цикл воркера: берет апдейты из очереди и обрабатывает до ``max_pending`` одновременно.
+
+    Порядок сообщений одного пользователя сохраняет AgentExecutor (личная
+    блокировка на пользователя). Получив стоп-сигнал, воркер перестает брать
+    новые апдейты и дожидается уже начатых.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max_pending)
+    pending = set()
+
+    async def process(update):
+        try:
+            await handle_update(update)
+        except Exception as e:
+            logger.warning("Update %s failed: %s", update.get('update_id'), e)
+        finally:
+            slots.release()
+
+    while (update := await loop.run_in_executor(None, updates.get)) is not _STOP:
+        await slots.acquire()
+        task = asyncio.create_task(process(update))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+
+def _worker_entry(target, index: int, updates) -> None:
+    # Остановкой управляет родитель через стоп-сигнал в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    target(index, updates)
+
+
+async def serve_webhook(
+    target,
+    workers: int,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    path: str = "/webhook",
+    secret: str | None = None,
+    queue_size: int = 1000,
+    drain_timeout: float = 30,
+    supervise_interval: float = 5,
+    on_startup=None,
+) -> None:
+    """
+    Запускает ``workers`` процессов ``target(index, updates)`` и aiohttp-приемник перед ними.
+
+    Упавший воркер перезапускается (проверка раз в ``supervise_interval``
+    секунд) с той же очередью, поэтому его пользователи не остаются без ответа.
+
+    По SIGTERM/SIGINT приемник перестает принимать апдейты, каждому воркеру
+    отправляется стоп-сигнал, и воркеры за ``drain_timeout`` секунд
+    дообрабатывают свои очереди; не успевшие завершаются принудительно.
+    """
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+
+    def spawn(index: int):
+        process = context.Process(target=_worker_entry, args=(target, index, queues[index]), name=f"bot-worker-{index}")
+        process.start()
+        return process
+
+    processes = [spawn(i) for i in range(workers)]
+
+    front = WebhookFront(queues, path=path, secret=secret)
+    front.stats["restarts"] = 0
+    metrics.add_stats("bot_webhook", front.stats)
+    metrics.add_stats("bot_webhook", lambda: {"workers_alive": sum(process.is_alive() for process in processes)})
+    metrics.add_stats("bot_webhook", lambda: {"queued": sum(updates.qsize() for updates in queues)})
+    runner = web.AppRunner(front.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if on_startup is not None:
+        await on_startup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, AttributeError):
+            pass
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), supervise_interval)
+            except asyncio.TimeoutError:
+                pass
+            for index, process in enumerate(processes):
+                if not stop.is_set() and not process.is_alive():
+                    logger.error("Worker %s exited with code %s, restarting", index, process.exitcode)
+                    front.stats["restarts"] += 1
+                    processes[index] = spawn(index)
+    finally:
+        front.draining = True
+        await runner.cleanup()
+        for updates in queues:
+            await loop.run_in_executor(None, updates.put, _STOP)
+        deadline = loop.time() + drain_timeout
+        for process in processes:
+            await loop.run_in_executor(None, process.join, max(0, deadline - loop.time()))
+            if process.is_alive():
+                process.terminate()
@@ -1,14 +1,15 @@
-from dotenv import dotenv_values # type: ignore
-from langchain_gigachat.chat_models import GigaChat # type: ignore
-from langchain_core.tools import tool # type: ignore
+import asyncio
+import logging
 from langgraph.prebuilt import create_react_agent # type: ignore
-from langgraph.checkpoint.postgres import PostgresSaver # type: ignore
+from llm.compaction import compact_messages
+from llm.result_shaping import shape_books
+from llm.tool_runner import DeadlineToolNode, async_tool
 from service.googlebooks import GoogleBooksSearcherByGenre, GoogleBooksUniversalSearch, search_google
-from service.duckduck_search import duckduckgo_search
-import json
+from service.duckduck_search import aduckduckgo_search, duckduckgo_search, link_prefetcher
+from service.knowledge_base import knowledge_base
 
+logger = logging.getLogger(__name__)
 
-config_dotenv = dotenv_values(".env")
 
 system_prompt_llm = '''Ты бот-помошник по подбору книг. Твоя задача помочь человеку найти книгу по его критериям.
             Если тебе не хватает каких-то данных, запрашивай их у пользователя. Выдавай сразу всю информацию о книге, которую нашел.
@@ -17,8 +18,41 @@ system_prompt_llm = '''Ты бот-помошник по подбору книг
             '''
 
 # Tools for agent LLM
+# У каждого инструмента есть async-версия, которая используется при запуске графа через ainvoke
+# Общая часть sync и async версий вынесена в функции ниже; async-версии вызывают их в потоке
 
-@tool
+
+def _local_books(query: str):
+    """Свежие книги из локальной базы (сжатые для модели) или None, если нужно идти в Google Books."""
+    local = knowledge_base.search(query)
+    if local is None:
+        return None
+    link_prefetcher.schedule([book for book in local if "links" not in book])
+    return shape_books({"query": query, "source": "local", "books": local})
+
+
+def _store_books(parse_result: dict, prefetch_links: bool = False):
+    """Сохраняет книги из Google Books в базу и сжимает результат для модели."""
+    knowledge_base.ingest_google(parse_result["books"])
+    if prefetch_links:
+        # Следующим шагом модель обычно просит ссылки на эти книги: ищем их заранее
+        link_prefetcher.schedule(parse_result["books"])
+    return shape_books(parse_result)
+
+
+def _cached_links(query: str) -> tuple:
+    """Запрос ссылок (с поправкой на предсказанную книгу) и свежие ссылки из базы или None."""
+    # Если ссылки на эту книгу уже ищутся после универсального поиска, берем их результат
+    query = link_prefetcher.match(query) or query
+    return query, knowledge_base.links(query)
+
+
+async def _aget_books_by_genre(genre: str):
+    logger.debug("get_books_by_genre()")
+    books_by_google = await GoogleBooksSearcherByGenre().aget_books_info(genre)
+    return await asyncio.to_thread(_store_books, books_by_google)
+
+@async_tool(_aget_books_by_genre)
 def get_books_by_genre(genre: str):
     """
     Поиск книг по жанру. Переводи жанр на английский язык. Если результатов нет, то вызывай метод get_books_universal_search
@@ -30,14 +64,23 @@ def get_books_by_genre(genre: str):
     description - описание
     BuyLink - ссылка на покупку
     thumbnail - ссылка на обложку
+    Пустые поля не выводятся, описания сокращены.
+    repeated - сколько книг уже было в предыдущих результатах, truncated - сколько книг не поместилось в ответ
     """
-    print("\033[92m" + "get_books_by_genre()" + "\033[0m")
-    print("\033[92m" + "args: " + genre + "\033[0m")
+    logger.debug("get_books_by_genre(%s)", genre)
     searcher = GoogleBooksSearcherByGenre()
-    books_by_google = searcher.parse_and_return(genre)
-    return books_by_google
+    books_by_google = searcher.get_books_info(genre)
+    return _store_books(books_by_google)
 
-@tool
+async def _aget_books_universal_search(query: str):
+    logger.debug("get_books_universal_search()")
+    local = await asyncio.to_thread(_local_books, query)
+    if local is not None:
+        return local
+    parse_result = await GoogleBooksUniversalSearch().aget_books_info(query)
+    return await asyncio.to_thread(_store_books, parse_result, True)
+
+@async_tool(_aget_books_universal_search)
 def get_books_universal_search(query: str):
     '''
     Поиск по любым запросам пользователя: название, автор, жанр, описание. Переводи жанр на английский язык.
@@ -49,15 +92,30 @@ def get_books_universal_search(query: str):
     description - описание
     BuyLink - ссылка на покупку
     thumbnail - ссылка на обложку
+    links - уже найденные ссылки на покупку, для таких книг get_link_on_book вызывать не нужно
+    sberbank - книга есть в библиотеке Сбербанка: isReserved (если False, то доступна) и link
+    Пустые поля не выводятся, описания сокращены.
+    repeated - сколько книг уже было в предыдущих результатах, truncated - сколько книг не поместилось в ответ
     '''
-    print("\033[92m" + "get_books_universal_search()" + "\033[0m")
-    print("\033[92m" + "args: " + query + "\033[0m")
+    logger.debug("get_books_universal_search(%s)", query)
+    # Сначала ищем в локальной базе книг, в Google Books идем, только если там мало свежих книг
+    local = _local_books(query)
+    if local is not None:
+        return local
     parser = GoogleBooksUniversalSearch()
     parse_result = parser.get_books_info(query)
-    result = json.dumps(parse_result, ensure_ascii=False, indent=4)
-    return result
+    return _store_books(parse_result, prefetch_links=True)
+
+async def _aget_link_on_book(query: str):
+    logger.debug("get_link_on_book()")
+    query, links = await asyncio.to_thread(_cached_links, query)
+    if links is not None:
+        return links
+    duck = await aduckduckgo_search(query=query, site="ozon.ru", status=True)
+    await asyncio.to_thread(knowledge_base.attach_links, query, duck)
+    return duck
 
-@tool
+@async_tool(_aget_link_on_book)
 def get_link_on_book(query: str):
     """
     Поиск ссылок на покупку книги. Используется когда пользователь хочет узнать ссылки на книгу.
@@ -66,12 +124,20 @@ def get_link_on_book(query: str):
     "href": - Ссылка на книгу
     "body": - О книге
     """
-    print("\033[92m" + "get_link_on_book()" + "\033[0m")
-    print("\033[92m" + "args: " + query + "\033[0m")
+    logger.debug("get_link_on_book(%s)", query)
+    # Свежие ссылки на книгу из базы книг отдаем без поиска
+    query, links = _cached_links(query)
+    if links is not None:
+        return links
     duck = duckduckgo_search(query=query, site="ozon.ru", status=True)
+    knowledge_base.attach_links(query, duck)
     return duck
 
-@tool
+async def _aget_links_to_additional_information(query: str):
+    logger.debug("get_links_to_additional_information()")
+    return await aduckduckgo_search(query=query, status=False)
+
+@async_tool(_aget_links_to_additional_information)
 def get_links_to_additional_information(query: str):
     """
     Используется когда пользователь хочеть узнать дополниетельную информацию из внешних источников или
@@ -80,46 +146,34 @@ def get_links_to_additional_information(query: str):
     "href": - Ссылка на статью
     "body": - О статье
     """
-    print("\033[92m" + "get_links_to_additional_information()" + "\033[0m")
-    print("\033[92m" + "args: " + query + "\033[0m")
+    logger.debug("get_links_to_additional_information(%s)", query)
     duck = duckduckgo_search(query=query, status=False)
     return duck
 
 
-def agent_llm(message, config):
+def build_agent(model, checkpointer):
     """
-    This function creates and invokes a LLM library book recommendation agent.
-    
-    It utilizes the GigaChat model to process a user's message and recommend books 
-    based on the user's criteria. It employs tools specifically for retrieving genres 
-    and books from the LLM library. The agent operates within a context that 
-    manages a Postgres checkpoint to ensure data integrity.
-    
+    Compiles the LLM library agent graph.
+
+    Called by the agent registry at startup and on hot-reload, so the tool list
+    and the prompt are read from this module every time it is (re)imported.
+
     Args:
-        message (str): The input message from the user containing book search criteria.
-        config (dict): Configuration settings for the agent, including database and 
-                       model credentials.
-    
+        model: Shared GigaChat chat model.
+        checkpointer: Shared LangGraph checkpointer.
+
     Returns:
-        str: The content of the agent's response, which is a book recommendation or 
-             additional information request.
+        CompiledGraph: The ReAct agent ready to be invoked.
     """
-    with PostgresSaver.from_conn_string(config_dotenv.get("DB")) as checkpointer:
-        model = GigaChat(
-            credentials=config_dotenv.get("GIGACHAT_KEY"),
-            scope=config_dotenv.get("GIGACHAT_SCOPE"),
-            model=config_dotenv.get("GIGACHAT_MODEL"),
-            verify_ssl_certs=False,
-        )
-        tools = [
-                get_books_by_genre,
-                get_link_on_book,
-                get_links_to_additional_information,
-                get_books_universal_search,
-        ]
-        agent = create_react_agent(model,
-                                tools=tools,
-                                checkpointer=checkpointer,
-                                prompt=system_prompt_llm)
-        resp = agent.invoke({"messages": [("user", message)]}, config=config)
-        return resp["messages"][-1].content
\ No newline at end of file
+    tools = [
+        get_books_by_genre,
+        get_link_on_book,
+        get_links_to_additional_information,
+        get_books_universal_search,
+    ]
+    return create_react_agent(model,
+                              tools=DeadlineToolNode(tools),
+                              checkpointer=checkpointer,
+                              pre_model_hook=compact_messages,
+                              prompt=system_prompt_llm)
+
@@ -1,16 +1,25 @@
-from dotenv import dotenv_values # type: ignore
-from langchain_gigachat.chat_models import GigaChat # type: ignore
+import logging
+import time
+from datetime import datetime
 from langchain_core.tools import tool # type: ignore
 from langgraph.prebuilt import create_react_agent # type: ignore
-from langgraph.checkpoint.postgres import PostgresSaver # type: ignore
-from service.sberbank import get_and_parse_categories, get_and_parse_books
+from llm.compaction import compact_messages
+from llm.result_shaping import compact_book, dumps, shape_books
+from llm.tool_runner import DeadlineToolNode
+from service.sberbank_catalog import catalog
+from service.sberbank_search import search_index
 
+logger = logging.getLogger(__name__)
 
-config_dotenv = dotenv_values(".env")
 
 system_prompt_sberbank = '''Ты бот-помошник по подбору книг в библиотеке Сбербанка. Рекодмендуй книгу по запросу пользователя.
             Если тебе не хватает каких-то данных, запрашивай их у пользователя. Если пользователь запрашивает книгу, то сразу
             выдавай ссылку на нее. Выдавай всю информацию про книгу, которую найдешь.
+            Для поиска по свободному запросу (тема, название, автор с опечатками) используй find_books_sberbank,
+            для точных фильтров по жанру, автору и доступности - search_books_sberbank, а get_books_sberbank
+            вызывай, только если пользователь просит весь список книг.
+            Если пользователь спрашивает, доступна ли конкретная книга, проверяй ее через check_book_sberbank,
+            а на вопрос, что нового или что освободилось, отвечай через new_available_books_sberbank.
             '''
 
 # Tools for agent Sberbank
@@ -23,10 +32,101 @@ def get_books_sberbank():
     link - ссылка на книги на их сайте, если пользователь просит ссылку, то выдавай ссылку на сайт.
     description - описание.
     all - все данные.
+    truncated - сколько книг не поместилось в ответ, для них используй search_books_sberbank.
     """
-    print("\033[92m" + "get_books_by_genre_of_sberbank()" + "\033[0m")
-    all_books = get_and_parse_books()
-    return all_books
+    logger.debug("get_books_by_genre_of_sberbank()")
+    return shape_books([
+        {
+            "id": book["id"],
+            "link": book["link"],
+            "isReserved": book["isReserved"],
+            "all": f"{book['name']} | {book['author']} | {book['category']}",
+            "desccription": book["description"],
+        }
+        for book in catalog.books
+    ])
+
+@tool
+def search_books_sberbank(category: str = "", author: str = "", keyword: str = "", available_only: bool = False):
+    """
+    Поиск книг в библиотеке Сбербанка с фильтрами. Возвращает только подходящие книги.
+    category - часть названия категории (жанра) из get_genres_of_sberbank
+    author - часть имени автора
+    keyword - слова из названия или описания книги
+    available_only - True, если нужны только доступные (не зарезервированные) книги
+    Output: name - название, author - автор, category - категория, isReserved - если False, то книга доступна,
+    link - ссылка на книгу, description - описание (сокращено).
+    repeated - сколько книг уже было в предыдущих результатах, truncated - сколько не поместилось.
+    """
+    logger.debug("search_books_sberbank(category=%r, author=%r, keyword=%r, available_only=%r)",
+                 category, author, keyword, available_only)
+    return shape_books(catalog.search(category=category, author=author, keyword=keyword, available_only=available_only))
+
+@tool
+def find_books_sberbank(query: str, available_only: bool = False):
+    """
+    Полнотекстовый поиск книг в библиотеке Сбербанка по названию, автору, категории и описанию.
+    Устойчив к опечаткам и формам слов. Возвращает несколько самых подходящих книг.
+    query - запрос пользователя своими словами
+    available_only - True, если нужны только доступные (не зарезервированные) книги
+    Output: name, author, category, isReserved - если False, то книга доступна, link, description,
+    score - релевантность. repeated - сколько книг уже было в предыдущих результатах.
+    """
+    logger.debug("find_books_sberbank(%s)", query)
+    return shape_books(search_index.search(query, k=5, available_only=available_only))
+
+def _format_time(timestamp) -> str | None:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else None
+
+@tool
+def check_book_sberbank(book: str):
+    """
+    Проверка текущего статуса одной книги в библиотеке Сбербанка без загрузки всего списка.
+    book - id книги (из link или прошлых результатов) или ее название
+    Output: name, author, isReserved - если False, то книга доступна, link,
+    statusSince - с какого времени у книги этот статус (если известно).
+    """
+    logger.debug("check_book_sberbank(%s)", book)
+    book = str(book).strip()
+    if book.isdigit():
+        book_id = int(book)
+    else:
+        found = search_index.search(book, k=1)
+        if not found:
+            return "Книга не найдена"
+        book_id = found[0]["id"]
+    record = catalog.book_status(book_id)
+    if record is None:
+        return "Книга не найдена"
+    # Без shape_books: статус уже показанной в диалоге книги не должен отбрасываться как повтор
+    return dumps(compact_book({
+        "name": record["name"],
+        "author": record["author"],
+        "isReserved": record["isReserved"],
+        "link": record["link"],
+        "statusSince": _format_time(catalog.status_since(book_id)),
+    }))
+
+@tool
+def new_available_books_sberbank(hours: float = 24):
+    """
+    Книги библиотеки Сбербанка, которые освободились или появились за последние hours часов и сейчас доступны.
+    Output: name, author, category, link, availableSince - когда книга стала доступна.
+    """
+    logger.debug("new_available_books_sberbank(%s)", hours)
+    books = catalog.available_since(time.time() - float(hours) * 3600)
+    if not books:
+        return "За этот период новых доступных книг нет"
+    return dumps([
+        compact_book({
+            "name": book["name"],
+            "author": book["author"],
+            "category": book["category"],
+            "link": book["link"],
+            "availableSince": _format_time(catalog.status_since(book["id"])),
+        })
+        for book in books
+    ])
 
 @tool
 def get_genres_of_sberbank():
@@ -35,42 +135,35 @@ def get_genres_of_sberbank():
     Используется когда пользователь хочеть узнать жанры книг, которые есть в библиотеке Сбербанка.
     Output: name - название категории
     """
-    print("\033[92m" + "get_genres_of_sberbank()" + "\033[0m")
-    return get_and_parse_categories()
+    logger.debug("get_genres_of_sberbank()")
+    return " | ".join(catalog.categories())
 
 
-def agent_sberbank(message, config):  
+def build_agent(model, checkpointer):
     """
-    This function creates and invokes a Sberbank library book recommendation agent.
-    
-    It utilizes the GigaChat model to process a user's message and recommend books 
-    based on the user's criteria. It employs tools specifically for retrieving genres 
-    and books from the Sberbank library. The agent operates within a context that 
-    manages a Postgres checkpoint to ensure data integrity.
-    
+    Compiles the Sberbank library agent graph.
+
+    Called by the agent registry at startup and on hot-reload, so the tool list
+    and the prompt are read from this module every time it is (re)imported.
+
     Args:
-        message (str): The input message from the user containing book search criteria.
-        config (dict): Configuration settings for the agent, including database and 
-                       model credentials.
-    
+        model: Shared GigaChat chat model.
+        checkpointer: Shared LangGraph checkpointer.
+
     Returns:
-        str: The content of the agent's response, which is a book recommendation or 
-             additional information request.
+        CompiledGraph: The ReAct agent ready to be invoked.
     """
-    with PostgresSaver.from_conn_string(config_dotenv.get("DB")) as checkpointer:
-        model = GigaChat(
-            credentials=config_dotenv.get("GIGACHAT_KEY"),
-            scope=config_dotenv.get("GIGACHAT_SCOPE"),
-            model=config_dotenv.get("GIGACHAT_MODEL"),
-            verify_ssl_certs=False,
-        )
-        tools = [
-                get_genres_of_sberbank,
-                get_books_sberbank,
-        ]
-        agent = create_react_agent(model,
-                                tools=tools,
-                                checkpointer=checkpointer,
-                                prompt=system_prompt_sberbank)
-        resp = agent.invoke({"messages": [("user", message)]}, config=config)
-        return resp["messages"][-1].content
+    tools = [
+        get_genres_of_sberbank,
+        get_books_sberbank,
+        search_books_sberbank,
+        find_books_sberbank,
+        check_book_sberbank,
+        new_available_books_sberbank,
+    ]
+    return create_react_agent(model,
+                              tools=DeadlineToolNode(tools),
+                              checkpointer=checkpointer,
+                              pre_model_hook=compact_messages,
+                              prompt=system_prompt_sberbank)
+
@@ -0,0 +1,153 @@
+import asyncio
+import math
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage # type: ignore
+from settings import settings
+from llm.checkpointer import checkpointer_pool
+from llm.registry import registry
+from service.sberbank_catalog import catalog
+from service.sberbank_search import stem, tokenize, trigrams
+
+
+ANSWER_CACHE_ENABLED = settings.get_bool("ANSWER_CACHE_ENABLED", True)
+ANSWER_CACHE_THRESHOLD = settings.get_float("ANSWER_CACHE_THRESHOLD", 0.85)
+ANSWER_CACHE_TTL = settings.get_float("ANSWER_CACHE_TTL", 6 * 3600)
+ANSWER_CACHE_SIZE = settings.get_int("ANSWER_CACHE_SIZE", 2000)
+
+VECTOR_DIM = 2 ** 18
+TRIGRAM_WEIGHT = 0.3
+
+# Слова-связки из просьб о рекомендации: без них "посоветуй фантастику"
+# и "посоветуй детектив" перестают выглядеть похожими
+STOP_WORDS = {stem(word) for word in (
+    "посоветуй", "посоветуйте", "порекомендуй", "порекомендуйте", "подскажи", "подскажите",
+    "найди", "найдите", "хочу", "можно", "пожалуйста", "что", "почитать", "прочитать", "книгу",
+    "книги", "книга", "книг", "мне", "про", "по", "о", "об", "на", "в", "и", "с", "какую", "какие",
+    "какой", "есть", "интересную", "интересные", "хорошую", "хорошие", "лучшие", "нибудь", "бы",
+)}
+
+
+def _feature(name: str) -> int:
+    return zlib.crc32(name.encode("utf-8")) % VECTOR_DIM
+
+
+def embed(text: str) -> dict:
+    """
+    Разреженный L2-нормированный вектор запроса из хешированных признаков.
+
+    Признаки: основы слов (см. service.sberbank_search.stem) без стоп-слов и,
+    с меньшим весом, их триграммы, чтобы опечатки и формы слов не мешали.
+    """
+    vector: dict = {}
+    for token in tokenize(text):
+        if token in STOP_WORDS:
+            continue
+        index = _feature("w:" + token)
+        vector[index] = vector.get(index, 0.0) + 1.0
+        for gram in trigrams(token):
+            index = _feature("t:" + gram)
+            vector[index] = vector.get(index, 0.0) + TRIGRAM_WEIGHT
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    return {index: value / norm for index, value in vector.items()} if norm else {}
+
+
+def similarity(left: dict, right: dict) -> float:
+    if len(left) > len(right):
+        left, right = right, left
+    return sum(value * right.get(index, 0.0) for index, value in left.items())
+
+
+class AnswerCache:
+    """
+    Кэш ответов агентов на похожие первые вопросы диалога.
+
+    Запросы сравниваются по косинусной близости векторов ``embed``; ответ
+    отдается, если близость не ниже ``threshold`` и ему меньше ``ttl`` секунд.
+    Записи разделены по типу агента, каждая область ограничена ``maxsize``
+    (LRU, поиск полным перебором). Область ``sberbank`` сбрасывается при
+    изменении каталога, потому что ответы зависят от наличия книг.
+
+    Args:
+        threshold: Минимальная близость запросов для попадания.
+        ttl: Время жизни ответа в секундах.
+        maxsize: Максимум ответов на один тип агента.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 maxsize: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+        self._scopes: dict = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._scopes.values())
+
+    def lookup(self, agent_type: str, query: str) -> str | None:
+        vector = embed(query)
+        if not vector:
+            self.stats["misses"] += 1
+            return None
+        now = time.time()
+        best_key, best_score = None, self.threshold
+        with self._lock:
+            entries = self._scopes.get(agent_type, {})
+            for key, (entry_vector, _, stored_at) in list(entries.items()):
+                if now - stored_at > self.ttl:
+                    del entries[key]
+                    continue
+                score = similarity(vector, entry_vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.stats["misses"] += 1
+                return None
+            entries.move_to_end(best_key)
+            self.stats["hits"] += 1
+            return entries[best_key][1]
+
+    def store(self, agent_type: str, query: str, answer: str) -> None:
+        vector = embed(query)
+        if not vector or not answer:
+            return
+        key = " ".join(tokenize(query))
+        with self._lock:
+            entries = self._scopes.setdefault(agent_type, OrderedDict())
+            entries[key] = (vector, answer, time.time())
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+            self.stats["stores"] += 1
+
+    def clear(self, agent_type: str | None = None) -> None:
+        with self._lock:
+            if agent_type is None:
+                self._scopes.clear()
+            else:
+                self._scopes.pop(agent_type, None)
+
+
+async def record_answer(agent_type: str, message: str, answer: str, config: dict, **metadata) -> None:
+    """
+    Дописывает вопрос и ответ, данный без агента, в историю диалога, чтобы следующие вопросы шли с контекстом.
+
+    ``metadata`` (откуда взят ответ) сохраняется в response_metadata ответа, GigaChat его не видит.
+    """
+    # На холодном процессе get() создает GigaChat и собирает граф, это не должно блокировать event loop
+    agent = await asyncio.to_thread(registry.get, agent_type)
+    values = {"messages": [HumanMessage(message), AIMessage(answer, response_metadata=metadata)]}
+    if checkpointer_pool.is_async:
+        await agent.aupdate_state(config, values, as_node="agent")
+    else:
+        await asyncio.to_thread(agent.update_state, config, values, as_node="agent")
+
+
+answer_cache = AnswerCache()
+# Ответы агента Сбербанка зависят от каталога и доступности книг: сбрасываем их при любом изменении
+catalog.on_update(lambda: answer_cache.clear("sberbank"))
+catalog.on_status(lambda book: answer_cache.clear("sberbank"))
@@ -0,0 +1,166 @@
+import logging
+from psycopg.rows import dict_row # type: ignore
+from psycopg_pool import AsyncConnectionPool, ConnectionPool # type: ignore
+from langgraph.checkpoint.postgres import PostgresSaver # type: ignore
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver # type: ignore
+from settings import settings
+from monitoring.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+# Те же параметры соединения, что и в PostgresSaver.from_conn_string
+CONNECTION_KWARGS = {
+    "autocommit": True,
+    "prepare_threshold": 0,
+    "row_factory": dict_row,
+}
+
+
+class TimedPostgresSaver(PostgresSaver):
+    """PostgresSaver, замеряющий загрузку и сохранение чекпоинтов (стадии checkpoint_load/checkpoint_save)."""
+
+    def get_tuple(self, config):
+        with span("checkpoint_load"):
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with span("checkpoint_save"):
+            return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with span("checkpoint_writes"):
+            return super().put_writes(config, writes, task_id, task_path)
+
+
+class TimedAsyncPostgresSaver(AsyncPostgresSaver):
+    """Асинхронный вариант TimedPostgresSaver."""
+
+    async def aget_tuple(self, config):
+        with span("checkpoint_load"):
+            return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with span("checkpoint_save"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with span("checkpoint_writes"):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
+
+class CheckpointerPool:
+    """
+    Process-wide Postgres connection pool backing the LangGraph checkpointer.
+
+    One pool is opened at bot startup and shared by every conversation, so a
+    message no longer pays for a fresh TCP + auth handshake. ``setup()`` of the
+    saver is run on open; it only applies missing migrations, so it is safe to
+    call on every start. Both the sync ``PostgresSaver`` and the async
+    ``AsyncPostgresSaver`` are supported.
+
+    Args:
+        conninfo (str): Postgres connection string. Defaults to ``DB`` from ``.env``.
+        min_size (int): Connections kept open when idle.
+        max_size (int): Upper bound on open connections.
+        timeout (float): Seconds to wait for a free connection before failing.
+        max_idle (float): Seconds after which an idle connection above min_size is closed.
+    """
+
+    def __init__(
+        self,
+        conninfo: str | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        timeout: float | None = None,
+        max_idle: float | None = None,
+    ):
+        self.conninfo = conninfo or settings.get("DB")
+        self.min_size = min_size or settings.get_int("DB_POOL_MIN_SIZE", 2)
+        self.max_size = max_size or settings.get_int("DB_POOL_MAX_SIZE", 10)
+        self.timeout = timeout or settings.get_float("DB_POOL_TIMEOUT", 30)
+        self.max_idle = max_idle or settings.get_float("DB_POOL_MAX_IDLE", 600)
+        self.pool = None
+        self.saver = None
+
+    def _pool_kwargs(self) -> dict:
+        return {
+            "conninfo": self.conninfo,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "timeout": self.timeout,
+            "max_idle": self.max_idle,
+            "kwargs": CONNECTION_KWARGS,
+            "open": False,
+        }
+
+    def open(self) -> PostgresSaver:
+        """Opens the sync pool, runs ``setup()`` and returns the shared saver."""
+        if self.saver is None:
+            self.pool = ConnectionPool(check=ConnectionPool.check_connection, **self._pool_kwargs())
+            self.pool.open(wait=True, timeout=self.timeout)
+            self.saver = TimedPostgresSaver(self.pool)
+            self.saver.setup()
+        return self.saver
+
+    async def aopen(self) -> AsyncPostgresSaver:
+        """Async counterpart of :meth:`open` for graphs driven by ``ainvoke``/``astream``."""
+        if self.saver is None:
+            self.pool = AsyncConnectionPool(check=AsyncConnectionPool.check_connection, **self._pool_kwargs())
+            await self.pool.open(wait=True, timeout=self.timeout)
+            self.saver = TimedAsyncPostgresSaver(self.pool)
+            await self.saver.setup()
+        return self.saver
+
+    @property
+    def is_async(self) -> bool:
+        return isinstance(self.pool, AsyncConnectionPool)
+
+    def health_check(self) -> bool:
+        """Runs ``SELECT 1`` on a pooled connection."""
+        try:
+            with self.pool.connection(timeout=self.timeout) as conn:
+                conn.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning("Checkpointer pool health check failed: %s", e)
+            return False
+
+    async def ahealth_check(self) -> bool:
+        try:
+            async with self.pool.connection(timeout=self.timeout) as conn:
+                await conn.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning("Checkpointer pool health check failed: %s", e)
+            return False
+
+    def stats(self) -> dict:
+        """Pool counters from psycopg plus the share of connections currently in use."""
+        if self.pool is None:
+            return {}
+        stats = self.pool.get_stats()
+        in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+        stats["in_use"] = in_use
+        stats["saturation"] = in_use / self.max_size
+        return stats
+
+    def close(self) -> None:
+        # Асинхронный пул закрывается только через aclose()
+        if self.pool is None or self.is_async:
+            return
+        self.pool.close()
+        self.pool = None
+        self.saver = None
+
+    async def aclose(self) -> None:
+        if self.pool is not None:
+            if self.is_async:
+                await self.pool.close()
+            else:
+                self.pool.close()
+        self.pool = None
+        self.saver = None
+
+
+checkpointer_pool = CheckpointerPool()
@@ -0,0 +1,181 @@
+import logging
+import threading
+import psycopg # type: ignore
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage # type: ignore
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+HISTORY_MAX_TURNS = settings.get_int("HISTORY_MAX_TURNS", 4)
+TOOL_OUTPUT_MAX_CHARS = settings.get_int("TOOL_OUTPUT_MAX_CHARS", 6000)
+OLD_TOOL_OUTPUT_MAX_CHARS = settings.get_int("OLD_TOOL_OUTPUT_MAX_CHARS", 300)
+SUMMARY_SNIPPET_CHARS = 200
+
+CHECKPOINT_KEEP_LAST = settings.get_int("CHECKPOINT_KEEP_LAST", 2)
+THREAD_TTL_HOURS = settings.get_float("THREAD_TTL_HOURS", 24 * 14)
+JANITOR_INTERVAL = settings.get_float("JANITOR_INTERVAL", 3600)
+
+
+def _truncate(text, limit: int):
+    if not isinstance(text, str) or len(text) <= limit:
+        return text
+    return text[:limit] + f"... [обрезано {len(text) - limit} символов]"
+
+
+def _summarize(messages) -> str:
+    """Cheap extractive summary of dropped turns: the start of each user/assistant message."""
+    lines = []
+    for msg in messages:
+        if not isinstance(msg.content, str) or not msg.content:
+            continue
+        if isinstance(msg, HumanMessage):
+            lines.append(f"- Пользователь: {_truncate(msg.content, SUMMARY_SNIPPET_CHARS)}")
+        elif isinstance(msg, AIMessage):
+            lines.append(f"- Ассистент: {_truncate(msg.content, SUMMARY_SNIPPET_CHARS)}")
+    return "\n".join(lines)
+
+
+def compact_messages(state: dict) -> dict:
+    """
+    ``pre_model_hook`` that bounds the prompt sent to GigaChat.
+
+    Only the model input is rewritten; the checkpointed history is untouched.
+    Turns older than ``HISTORY_MAX_TURNS`` are folded into a short summary that
+    is prepended to the first kept user message, tool outputs from previous
+    turns are cut to ``OLD_TOOL_OUTPUT_MAX_CHARS`` and tool outputs of the
+    current turn to ``TOOL_OUTPUT_MAX_CHARS``. History is always cut on a user
+    message boundary so tool calls and their results stay paired.
+    """
+    messages = state["messages"]
+    human_indexes = [i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage)]
+    if not human_indexes:
+        return {"llm_input_messages": messages}
+
+    start = human_indexes[-HISTORY_MAX_TURNS] if len(human_indexes) > HISTORY_MAX_TURNS else 0
+    current_turn = human_indexes[-1]
+    compacted = []
+    for i, msg in enumerate(messages[start:], start):
+        if isinstance(msg, ToolMessage):
+            limit = TOOL_OUTPUT_MAX_CHARS if i > current_turn else OLD_TOOL_OUTPUT_MAX_CHARS
+            if isinstance(msg.content, str) and len(msg.content) > limit:
+                msg = msg.model_copy(update={"content": _truncate(msg.content, limit)})
+        compacted.append(msg)
+
+    summary = _summarize(messages[:start])
+    if summary:
+        first = compacted[0]
+        compacted[0] = first.model_copy(update={
+            "content": f"Краткое содержание предыдущего диалога:\n{summary}\n\n{first.content}"
+        })
+    return {"llm_input_messages": compacted}
+
+
+# Удаляем все чекпоинты треда, кроме последних keep_last
+PRUNE_CHECKPOINTS_SQL = """
+DELETE FROM checkpoints c
+USING (
+    SELECT thread_id, checkpoint_ns, checkpoint_id,
+           row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+    FROM checkpoints
+) ranked
+WHERE c.thread_id = ranked.thread_id
+  AND c.checkpoint_ns = ranked.checkpoint_ns
+  AND c.checkpoint_id = ranked.checkpoint_id
+  AND ranked.rn > %(keep_last)s
+"""
+
+# Треды без новых чекпоинтов последние 10 минут: в них точно не идет запись,
+# поэтому висячие writes и блобы можно удалять без гонки с агентом
+QUIET_THREADS_SQL = """
+    SELECT thread_id FROM checkpoints
+    GROUP BY thread_id
+    HAVING max((checkpoint ->> 'ts')::timestamptz) < now() - interval '10 minutes'
+"""
+
+PRUNE_WRITES_SQL = f"""
+DELETE FROM checkpoint_writes w
+WHERE w.thread_id IN ({QUIET_THREADS_SQL})
+  AND NOT EXISTS (
+    SELECT 1 FROM checkpoints c
+    WHERE c.thread_id = w.thread_id
+      AND c.checkpoint_ns = w.checkpoint_ns
+      AND c.checkpoint_id = w.checkpoint_id
+)
+"""
+
+# Блобы, на версии которых не ссылается ни один оставшийся чекпоинт
+PRUNE_BLOBS_SQL = f"""
+DELETE FROM checkpoint_blobs b
+WHERE b.thread_id IN ({QUIET_THREADS_SQL})
+  AND NOT EXISTS (
+    SELECT 1 FROM checkpoints c
+    WHERE c.thread_id = b.thread_id
+      AND c.checkpoint_ns = b.checkpoint_ns
+      AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+)
+"""
+
+EXPIRED_THREADS_SQL = """
+SELECT thread_id
+FROM checkpoints
+GROUP BY thread_id
+HAVING max((checkpoint ->> 'ts')::timestamptz) < now() - make_interval(secs => %(ttl)s)
+"""
+
+
+class CheckpointJanitor:
+    """
+    Background thread that keeps the checkpoint tables bounded.
+
+    Every ``interval`` seconds it deletes threads whose last checkpoint is older
+    than ``ttl_hours`` (dialogs abandoned after ``/new`` and ``/sber_new``) and
+    prunes superseded checkpoints, their pending writes and orphaned blobs,
+    keeping the last ``keep_last`` checkpoints of every thread.
+
+    It uses its own short-lived connection so it never competes with user
+    traffic for pooled connections.
+    """
+
+    def __init__(
+        self,
+        conninfo: str | None = None,
+        ttl_hours: float = THREAD_TTL_HOURS,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        interval: float = JANITOR_INTERVAL,
+    ):
+        self.conninfo = conninfo or settings.get("DB")
+        self.ttl_hours = ttl_hours
+        self.keep_last = max(1, keep_last)
+        self.interval = interval
+        self.stats = {"runs": 0, "threads_deleted": 0, "checkpoints_pruned": 0, "blobs_pruned": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="checkpoint-janitor", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_once(self) -> None:
+        with psycopg.connect(self.conninfo, autocommit=True) as conn:
+            expired = [
+                row[0] for row in conn.execute(EXPIRED_THREADS_SQL, {"ttl": self.ttl_hours * 3600})
+            ]
+            for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ANY(%s)", (expired,))
+            pruned = conn.execute(PRUNE_CHECKPOINTS_SQL, {"keep_last": self.keep_last}).rowcount
+            conn.execute(PRUNE_WRITES_SQL)
+            blobs = conn.execute(PRUNE_BLOBS_SQL).rowcount
+        self.stats["runs"] += 1
+        self.stats["threads_deleted"] += len(expired)
+        self.stats["checkpoints_pruned"] += pruned
+        self.stats["blobs_pruned"] += blobs
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("Checkpoint janitor failed: %s", e)
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from monitoring.tracing import record
+
+
+class AgentExecutor:
+    """
+    Runs agent invocations off the aiogram event loop.
+
+    Synchronous agents are dispatched to a bounded thread pool, coroutine
+    functions (native ``ainvoke`` path) are awaited directly. A global semaphore
+    caps the number of agent runs in flight, and a per-user lock keeps the
+    messages of a single user ordered.
+
+    Args:
+        max_workers (int): Size of the thread pool for synchronous agents.
+        max_concurrency (int): Global cap on concurrently running agents.
+        latency_window (int): How many recent latencies to keep for stats.
+    """
+
+    def __init__(self, max_workers: int = 8, max_concurrency: int = 8, latency_window: int = 1000):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._user_locks: dict[Any, asyncio.Lock] = {}
+        self._user_refs: dict[Any, int] = {}
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_times = deque(maxlen=latency_window)
+        self._run_times = deque(maxlen=latency_window)
+
+    async def run(self, user_id: Any, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs ``func`` for ``user_id`` after the user's previous messages, within the global cap."""
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        self._user_refs[user_id] = self._user_refs.get(user_id, 0) + 1
+        self.queued += 1
+        waiting = True
+        enqueued_at = time.perf_counter()
+        try:
+            async with lock, self._semaphore:
+                self.queued -= 1
+                waiting = False
+                started_at = time.perf_counter()
+                self._wait_times.append(started_at - enqueued_at)
+                record("queue_wait", enqueued_at, started_at - enqueued_at)
+                self.in_flight += 1
+                try:
+                    if asyncio.iscoroutinefunction(func):
+                        result = await func(*args, **kwargs)
+                    else:
+                        # run_in_executor не копирует контекст, а в нем текущий трейс
+                        loop = asyncio.get_running_loop()
+                        context = contextvars.copy_context()
+                        result = await loop.run_in_executor(
+                            self.pool, functools.partial(context.run, func, *args, **kwargs)
+                        )
+                    self.completed += 1
+                    return result
+                except BaseException:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    self._run_times.append(time.perf_counter() - started_at)
+        finally:
+            if waiting:
+                self.queued -= 1
+            self._user_refs[user_id] -= 1
+            if not self._user_refs[user_id]:
+                # Освобождаем lock, чтобы словарь не рос бесконечно
+                del self._user_refs[user_id]
+                del self._user_locks[user_id]
+
+    def stats(self) -> dict:
+        """Returns queue depth, in-flight count and latency percentiles (seconds)."""
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "active_users": len(self._user_locks),
+            "wait_p50": _percentile(self._wait_times, 50),
+            "wait_p95": _percentile(self._wait_times, 95),
+            "run_p50": _percentile(self._run_times, 50),
+            "run_p95": _percentile(self._run_times, 95),
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _percentile(values, percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,169 @@
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from settings import settings
+from llm.checkpointer import checkpointer_pool
+
+logger = logging.getLogger(__name__)
+
+
+# Тип агента -> модуль, в котором объявлены промпт, инструменты и build_agent()
+AGENT_MODULES = {
+    "default": "llm.agent_llm",
+    "sberbank": "llm.agent_sberbank",
+}
+
+
+def create_gigachat():
+    """Creates the GigaChat chat model configured from ``.env``."""
+    # Imported here: langchain_gigachat is only needed once the first agent is used
+    from langchain_gigachat.chat_models import GigaChat # type: ignore
+
+    return GigaChat(
+        credentials=settings.get("GIGACHAT_KEY"),
+        scope=settings.get("GIGACHAT_SCOPE"),
+        model=settings.get("GIGACHAT_MODEL"),
+        verify_ssl_certs=False,
+    )
+
+
+class TokenRefresher:
+    """
+    Background thread that renews the GigaChat OAuth token before it expires.
+
+    The gigachat client only re-authenticates after a request fails with 401,
+    which costs a user an extra round-trip. Refreshing ``margin`` seconds ahead
+    of ``expires_at`` keeps the shared token always valid.
+    """
+
+    def __init__(self, model, margin: float = 120, check_interval: float = 30):
+        self.model = model
+        self.margin = margin
+        self.check_interval = check_interval
+        self.refreshes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="gigachat-token", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _expires_in(self) -> float:
+        token = self.model._client._access_token
+        if not token or not token.expires_at:
+            return 0
+        # expires_at приходит в миллисекундах
+        return token.expires_at / 1000 - time.time()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._expires_in() <= self.margin:
+                    self.model._client.get_token()
+                    self.refreshes += 1
+            except Exception as e:
+                logger.warning("GigaChat token refresh failed: %s", e)
+            self._stop.wait(self.check_interval)
+
+
+class AgentRegistry:
+    """
+    Long-lived holder of compiled agent graphs.
+
+    One authenticated GigaChat client and the pooled checkpointer are shared by
+    every agent type. Agent modules (and langgraph with them) are imported and
+    compiled on first use of each agent type (or ahead of time by ``main.prewarm``).
+    ``reload`` re-imports an agent module and swaps in a freshly compiled graph,
+    so prompts and tools can be changed without restarting the bot.
+    """
+
+    def __init__(self, modules: dict[str, str] = AGENT_MODULES):
+        self.modules = dict(modules)
+        self.model = None
+        self.checkpointer = None
+        self._graphs = {}
+        self._refresher = None
+        self._lock = threading.RLock()
+        self._started = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    def start(self, checkpointer=None, model=None) -> None:
+        """
+        Opens the checkpointer pool and creates the GigaChat client; agents are compiled lazily.
+
+        ``checkpointer`` and ``model`` override the Postgres saver and GigaChat
+        (the benchmark harness passes in-memory stand-ins).
+        """
+        with self._lock:
+            if self.started:
+                return
+            self.checkpointer = checkpointer or checkpointer_pool.open()
+            if model is None:
+                self.model = create_gigachat()
+                self._refresher = TokenRefresher(self.model)
+                self._refresher.start()
+            else:
+                self.model = model
+            self._started = True
+
+    def _build(self, agent_type: str, reload: bool = False):
+        module = importlib.import_module(self.modules[agent_type])
+        if reload:
+            module = importlib.reload(module)
+        return module.build_agent(self.model, self.checkpointer)
+
+    def get(self, agent_type: str):
+        """Returns the compiled graph for ``agent_type``, starting the registry and compiling it if needed."""
+        graph = self._graphs.get(agent_type)
+        if graph is not None:
+            return graph
+        with self._lock:
+            if not self.started:
+                self.start()
+            if agent_type not in self._graphs:
+                self._graphs[agent_type] = self._build(agent_type)
+            return self._graphs[agent_type]
+
+    def invoke(self, agent_type: str, message: str, config: dict) -> str:
+        """Runs the agent on ``message`` and returns the text of its answer."""
+        resp = self.get(agent_type).invoke({"messages": [("user", message)]}, config=config)
+        return resp["messages"][-1].content
+
+    async def ainvoke(self, agent_type: str, message: str, config: dict) -> str:
+        """Async counterpart of :meth:`invoke` (requires the async checkpointer)."""
+        graph = await asyncio.to_thread(self.get, agent_type)
+        resp = await graph.ainvoke({"messages": [("user", message)]}, config=config)
+        return resp["messages"][-1].content
+
+    def reload(self, agent_type: str | None = None) -> None:
+        """Re-imports agent modules and atomically replaces their compiled graphs."""
+        with self._lock:
+            if not self.started:
+                return
+            for name in [agent_type] if agent_type else list(self.modules):
+                self._graphs[name] = self._build(name, reload=True)
+                logger.info("Agent '%s' reloaded", name)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._refresher:
+                self._refresher.stop()
+            self._started = False
+            self._graphs.clear()
+            self.model = None
+            self.checkpointer = None
+        checkpointer_pool.close()
+
+    async def aclose(self) -> None:
+        self.close()
+        await checkpointer_pool.aclose()
+
+
+registry = AgentRegistry()
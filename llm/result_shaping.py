@@ -0,0 +1,160 @@
+import json
+import threading
+from collections import OrderedDict
+from langchain_core.runnables.config import ensure_config # type: ignore
+from settings import settings
+
+
+TOOL_OUTPUT_MAX_TOKENS = settings.get_int("TOOL_OUTPUT_MAX_TOKENS", 1200)
+DESCRIPTION_MAX_TOKENS = settings.get_int("DESCRIPTION_MAX_TOKENS", 60)
+
+# Та же оценка, что у GigaChat.get_num_tokens без use_api_for_tokens
+CHARS_PER_TOKEN = 4.6
+
+DESCRIPTION_FIELDS = ("description", "desccription")
+
+# Заглушки парсеров вместо отсутствующих значений: модели они ничего не дают
+PLACEHOLDERS = {
+    "Название не указано", "Автор не указан", "Жанр не указан", "Издатель не указан",
+    "Описание отсутствует", "Недоступно для покупки", "Год не указан",
+}
+
+stats = {"calls": 0, "tokens_before": 0, "tokens_after": 0, "books_dropped": 0, "duplicates": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    return round(len(text) / CHARS_PER_TOKEN)
+
+
+def dumps(value) -> str:
+    """Минифицированный JSON без экранирования кириллицы."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _is_empty(value) -> bool:
+    if isinstance(value, (list, tuple)):
+        return all(_is_empty(item) for item in value)
+    return value is None or value == "" or (isinstance(value, str) and value in PLACEHOLDERS)
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    limit = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip(" ,.;:") + "…"
+
+
+def compact_book(book: dict, description_tokens: int = DESCRIPTION_MAX_TOKENS) -> dict:
+    """Убирает пустые поля и заглушки, укорачивает описание до description_tokens токенов."""
+    compacted = {}
+    for key, value in book.items():
+        if isinstance(value, list):
+            value = [item for item in value if not _is_empty(item)]
+        if _is_empty(value):
+            continue
+        if key in DESCRIPTION_FIELDS and isinstance(value, str):
+            value = truncate_text(" ".join(value.split()), description_tokens)
+        compacted[key] = value
+    return compacted
+
+
+def book_key(book: dict) -> str:
+    title = book.get("title") or book.get("name") or ""
+    authors = book.get("authors") or book.get("author") or ""
+    if isinstance(authors, list):
+        authors = authors[0] if authors else ""
+    return " ".join(f"{title} {authors}".lower().replace("ё", "е").split())
+
+
+class SeenBooks:
+    """
+    Книги, уже отданные модели за текущий ход агента.
+
+    Повтор отсекается только в пределах одного ответа, когда несколько
+    инструментов находят одни и те же книги. Ход определяется парой
+    (thread_id, turn_id) из configurable; в следующем ходе книги снова
+    показываются целиком, ведь compact_messages обрезает старые результаты.
+    """
+
+    def __init__(self, max_turns: int = 1000):
+        self.max_turns = max_turns
+        self._turns: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, turn: tuple | None, books: list) -> tuple:
+        """Возвращает (еще не показанные книги, число повторов)."""
+        if turn is None:
+            return books, 0
+        with self._lock:
+            seen = self._turns.get(turn, set())
+            fresh = [book for book in books if book_key(book) not in seen]
+        return fresh, len(books) - len(fresh)
+
+    def remember(self, turn: tuple | None, books: list) -> None:
+        if turn is None:
+            return
+        with self._lock:
+            seen = self._turns.setdefault(turn, set())
+            self._turns.move_to_end(turn)
+            while len(self._turns) > self.max_turns:
+                self._turns.popitem(last=False)
+            seen.update(key for key in map(book_key, books) if key)
+
+
+seen_books = SeenBooks()
+
+
+def _current_turn() -> tuple | None:
+    configurable = ensure_config().get("configurable", {})
+    if configurable.get("thread_id") is None or configurable.get("turn_id") is None:
+        return None
+    return configurable["thread_id"], configurable["turn_id"]
+
+
+def shape_books(result, max_tokens: int = TOOL_OUTPUT_MAX_TOKENS, books_key: str = "books") -> str:
+    """
+    Приводит результат инструмента с книгами к компактному виду для модели.
+
+    ``result`` - список книг или словарь со списком под ``books_key``
+    (остальные непустые поля словаря сохраняются). Книги очищаются
+    compact_book, повторы уже показанных в этом ходе агента книг отбрасываются,
+    а список обрезается так, чтобы ответ уместился в ``max_tokens``
+    (по оценке estimate_tokens).
+
+    Returns:
+        str: Минифицированный JSON.
+    """
+    if isinstance(result, dict):
+        extra = {key: value for key, value in result.items() if key not in (books_key, "count") and not _is_empty(value)}
+        books = result.get(books_key) or []
+    else:
+        extra, books = {}, list(result or [])
+
+    stats["calls"] += 1
+    stats["tokens_before"] += estimate_tokens(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    turn = _current_turn()
+    books, repeated = seen_books.filter(turn, [compact_book(book) for book in books])
+    stats["duplicates"] += repeated
+
+    # Жадно набираем книги, пока оценка ответа укладывается в бюджет
+    budget = max_tokens - estimate_tokens(dumps(extra)) - 20
+    kept, used = [], 0
+    for book in books:
+        size = estimate_tokens(dumps(book)) + 1
+        if used + size > budget and kept:
+            break
+        kept.append(book)
+        used += size
+
+    output = dict(extra, count=len(kept), **{books_key: kept})
+    if repeated:
+        output["repeated"] = repeated
+    if len(kept) < len(books):
+        output["truncated"] = len(books) - len(kept)
+    text = dumps(output)
+
+    seen_books.remember(turn, kept)
+    stats["books_dropped"] += len(books) - len(kept)
+    stats["tokens_after"] += estimate_tokens(text)
+    return text
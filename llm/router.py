@@ -0,0 +1,198 @@
+import re
+from settings import settings
+from llm.answer_cache import STOP_WORDS, embed, similarity
+from monitoring.metrics import metrics
+from service.duckduck_search import duckduckgo_search
+from service.googlebooks import GoogleBooksUniversalSearch
+from service.knowledge_base import knowledge_base
+from service.sberbank_catalog import catalog
+from service.sberbank_search import search_index, tokenize
+
+
+ROUTER_ENABLED = settings.get_bool("ROUTER_ENABLED", True)
+ROUTER_MIN_CONFIDENCE = settings.get_float("ROUTER_MIN_CONFIDENCE", 0.75)
+
+DECISIONS = metrics.counter("bot_router_decisions_total", "Fast-path router decisions by intent (routed/fallback)")
+
+# Просьбы подобрать книгу и ссылки на прошлые ответы ("а она доступна?") требуют агента
+RECOMMEND_RE = re.compile(r"посоветуй|порекомендуй|подбери|найди|хочу|похож|интересн", re.IGNORECASE)
+PRONOUN_RE = re.compile(r"\b(ее|её|его|их|она|он|они|эта|эту|этой|этот|эти|этих|них|нее|неё|нем|ней)\b", re.IGNORECASE)
+QUOTED_RE = re.compile(r"[«\"“]([^»\"”]{2,})[»\"”]")
+
+GENRES_RE = re.compile(r"жанр|категори|рубрик|раздел", re.IGNORECASE)
+AVAILABILITY_RE = re.compile(r"доступн|свободн|есть ли|в наличии|можно ли взять|можно взять|занят|зарезервир|на руках", re.IGNORECASE)
+BUY_RE = re.compile(r"купить|приобрести|заказать|ссылк\w* на покупку", re.IGNORECASE)
+THANKS_RE = re.compile(r"^(спасибо|благодарю|спс|thanks|thank you)[!. ]*$", re.IGNORECASE)
+
+# Слова запросов, которые не относятся к названию книги
+QUERY_WORDS = {token for token in tokenize(
+    "доступна доступен доступно свободна свободен есть ли в наличии можно взять занята занят "
+    "зарезервирована зарезервирован на руках сейчас библиотеке библиотека купить приобрести заказать "
+    "где ссылка ссылку ссылки на покупку книгу книга книги"
+)} | STOP_WORDS
+
+# Примеры вопросов для классификатора: сходство с ними и есть уверенность маршрута
+GENRES_EXAMPLES = [embed(text) for text in (
+    "какие жанры есть", "список жанров", "какие категории есть в библиотеке", "покажи все категории книг",
+    "какие разделы есть", "перечисли жанры",
+)]
+
+GENRES_TEMPLATE = "📚 Категории книг в библиотеке Сбербанка:\n\n{categories}\n\nНапишите, что вас интересует, и я подберу книги."
+AVAILABLE_TEMPLATE = "✅ Книга «{name}» ({author}) сейчас доступна.\nСсылка: {link}"
+RESERVED_TEMPLATE = "⛔ Книга «{name}» ({author}) сейчас зарезервирована.\nСсылка: {link}"
+BUY_TEMPLATE = "🛒 Где купить «{title}»:\n\n{links}"
+THANKS_TEMPLATE = "Пожалуйста! Если захотите найти еще книги, просто напишите."
+
+
+class Route:
+    """Решение роутера: ответ по шаблону без вызова модели."""
+
+    def __init__(self, intent: str, confidence: float, answer: str):
+        self.intent = intent
+        self.confidence = confidence
+        self.answer = answer
+
+
+def _content_tokens(text: str) -> list:
+    return [token for token in tokenize(text) if token not in QUERY_WORDS]
+
+
+def _overlap(words: set, title: str, authors: list) -> float:
+    """
+    Насколько вопрос говорит именно об этой книге: все слова названия должны быть
+    в вопросе, а все содержательные слова вопроса - в названии или авторах.
+    """
+    name = set(tokenize(title))
+    name = name - QUERY_WORDS or name
+    if not name or not words:
+        return 0.0
+    # Фамилии склоняются не по правилам стеммера ("Булгакова" -> "булгаков", "Булгаков" -> "булгак"), поэтому сравниваем по началу
+    surnames = [token for token in tokenize(" ".join(authors)) if len(token) >= 4]
+    covered = [word for word in words
+               if word in name or any(word.startswith(surname) or surname.startswith(word) for surname in surnames)]
+    return min(len(name & words) / len(name), len(covered) / len(words))
+
+
+def _strip_query_words(text: str) -> str:
+    """Убирает служебные слова запроса по краям, оставляя название книги как есть."""
+    words = re.findall(r"[\w-]+", text)
+    while words and set(tokenize(words[0])) <= QUERY_WORDS:
+        words.pop(0)
+    while words and set(tokenize(words[-1])) <= QUERY_WORDS:
+        words.pop()
+    return " ".join(words)
+
+
+def _genres(text: str) -> tuple:
+    if not GENRES_RE.search(text) or RECOMMEND_RE.search(text):
+        return 0.0, None
+    query = embed(text)
+    confidence = max(similarity(query, example) for example in GENRES_EXAMPLES)
+
+    def answer():
+        categories = catalog.categories()
+        if not categories:
+            return None
+        return GENRES_TEMPLATE.format(categories="\n".join(f"• {name}" for name in categories))
+
+    return confidence, answer
+
+
+def _availability(text: str) -> tuple:
+    if not AVAILABILITY_RE.search(text) or PRONOUN_RE.search(text) or RECOMMEND_RE.search(text):
+        return 0.0, None
+    quoted = QUOTED_RE.search(text)
+    title = quoted.group(1) if quoted else text
+    words = set(_content_tokens(title))
+    if not words:
+        return 0.0, None
+
+    # Уверенность - взаимное покрытие слов вопроса и книги; совпадение должно быть единственным
+    matches = [(_overlap(words, book["name"], [book["author"]]), book) for book in search_index.search(title, k=3)]
+    if not matches:
+        return 0.0, None
+    matches.sort(key=lambda match: match[0], reverse=True)
+    confidence, book = matches[0]
+    if len(matches) > 1 and matches[1][0] == confidence and matches[1][1]["name"] != book["name"]:
+        confidence /= 2
+
+    def answer():
+        # Статус уточняем по книге отдельно: каталог мог обновиться несколько минут назад
+        fresh = catalog.book_status(book["id"]) or book
+        template = RESERVED_TEMPLATE if fresh["isReserved"] else AVAILABLE_TEMPLATE
+        return template.format(name=fresh["name"], author=fresh["author"], link=fresh["link"])
+
+    return confidence, answer
+
+
+def _buy_link(text: str) -> tuple:
+    if not BUY_RE.search(text) or PRONOUN_RE.search(text) or RECOMMEND_RE.search(text):
+        return 0.0, None
+    quoted = QUOTED_RE.search(text)
+    if quoted:
+        title = quoted.group(1).strip()
+    else:
+        # Название - то, что стоит после "купить" (или перед ним), без служебных слов
+        trigger = BUY_RE.search(text)
+        title = _strip_query_words(text[trigger.end():]) or _strip_query_words(text[:trigger.start()])
+    words = set(_content_tokens(title))
+    if not 1 <= len(words) <= 8:
+        return 0.0, None
+
+    # Уверенность - насколько извлеченное название совпадает с реальной книгой из базы или Google Books
+    books = knowledge_base.lookup(title)
+    if not books:
+        searcher = GoogleBooksUniversalSearch()
+        books = searcher.parse_book_data(searcher.search_books(title))
+    confidence = max((_overlap(words, book["title"], book["authors"]) for book in books), default=0.0)
+
+    def answer():
+        results = duckduckgo_search(query=title, site="ozon.ru", status=True)
+        if not isinstance(results, list) or not results:
+            return None
+        links = "\n".join(f"• {item.get('title', '')}\n{item.get('href', '')}" for item in results)
+        return BUY_TEMPLATE.format(title=title, links=links)
+
+    return confidence, answer
+
+
+def _thanks(text: str) -> tuple:
+    return (1.0, lambda: THANKS_TEMPLATE) if THANKS_RE.match(text) else (0.0, None)
+
+
+# Интенты в порядке проверки для каждого агента
+INTENTS = {
+    "sberbank": [("thanks", _thanks), ("genres", _genres), ("availability", _availability)],
+    "default": [("thanks", _thanks), ("buy_link", _buy_link)],
+}
+
+
+def route(agent_type: str, text: str, min_confidence: float = ROUTER_MIN_CONFIDENCE) -> Route | None:
+    """
+    Отвечает на простые вопросы без агента: список жанров и доступность книги
+    у Сбербанка, ссылки на покупку у обычного агента, благодарности.
+
+    Интент выбирается по ключевым словам, уверенность считает небольшой
+    классификатор (сходство с примерами вопросов или взаимное покрытие слов
+    вопроса и найденной книги). Ниже ``min_confidence`` вопрос уходит агенту.
+    Функция синхронная и может ходить в каталог и поиск, поэтому ее
+    запускают в пуле.
+
+    Returns:
+        Route | None: Готовый ответ или None, если вопрос нужно отдать агенту.
+    """
+    text = " ".join(text.split())
+    for intent, match in INTENTS.get(agent_type, []):
+        confidence, answer = match(text)
+        if answer is None:
+            continue
+        if confidence < min_confidence:
+            DECISIONS.inc(intent=intent, decision="fallback")
+            return None
+        reply = answer()
+        if reply is None:
+            DECISIONS.inc(intent=intent, decision="fallback")
+            return None
+        DECISIONS.inc(intent=intent, decision="routed")
+        return Route(intent, round(confidence, 3), reply)
+    return None
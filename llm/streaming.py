@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import threading
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage # type: ignore
+from llm.checkpointer import checkpointer_pool
+from llm.registry import registry
+
+STREAM_MODES = ["messages", "updates"]
+
+_DONE = object()
+
+
+class _EventTranslator:
+    """
+    Turns LangGraph ``messages``/``updates`` stream chunks into progress events.
+
+    Events are ``(kind, payload)`` tuples:
+
+    - ``("token", text)``: next piece of the model answer;
+    - ``("reset", None)``: text streamed so far was a preamble before tool calls;
+    - ``("tool_start", name)`` / ``("tool_end", name)``: tool call lifecycle;
+    - ``("final", text)``: the complete answer, always the last event.
+    """
+
+    def __init__(self):
+        self.streamed = ""
+        self.final = ""
+
+    def feed(self, mode: str, chunk) -> list:
+        events = []
+        if mode == "messages":
+            msg, metadata = chunk
+            if isinstance(msg, AIMessageChunk) and metadata.get("langgraph_node") == "agent" and msg.content:
+                self.streamed += msg.content
+                events.append(("token", msg.content))
+            return events
+        for update in chunk.values():
+            for msg in (update or {}).get("messages", []):
+                if isinstance(msg, AIMessage) and msg.tool_calls:
+                    if self.streamed:
+                        self.streamed = ""
+                        events.append(("reset", None))
+                    events.extend(("tool_start", call["name"]) for call in msg.tool_calls)
+                elif isinstance(msg, AIMessage):
+                    self.final = msg.content
+                elif isinstance(msg, ToolMessage):
+                    events.append(("tool_end", msg.name))
+        return events
+
+    def finish(self) -> tuple:
+        return "final", self.final or self.streamed
+
+
+def stream_agent(agent_type: str, message: str, config: dict):
+    """Runs an agent with ``stream`` and yields progress events (see ``_EventTranslator``)."""
+    agent = registry.get(agent_type)
+    translator = _EventTranslator()
+    for mode, chunk in agent.stream({"messages": [("user", message)]}, config=config, stream_mode=STREAM_MODES):
+        yield from translator.feed(mode, chunk)
+    yield translator.finish()
+
+
+async def astream_agent(agent_type: str, message: str, config: dict, pool=None):
+    """
+    Async iterator over agent progress events.
+
+    With the async checkpointer the graph is streamed natively via ``astream``;
+    otherwise the sync stream runs in ``pool`` (a worker thread) and events are
+    handed to the event loop through a queue.
+    """
+    if checkpointer_pool.is_async:
+        # The first build of a graph imports langgraph and GigaChat; keep it off the event loop
+        agent = await asyncio.to_thread(registry.get, agent_type)
+        translator = _EventTranslator()
+        async for mode, chunk in agent.astream(
+            {"messages": [("user", message)]}, config=config, stream_mode=STREAM_MODES
+        ):
+            for event in translator.feed(mode, chunk):
+                yield event
+        yield translator.finish()
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for event in stream_agent(agent_type, message, config):
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    future = loop.run_in_executor(pool, contextvars.copy_context().run, produce)
+    try:
+        while (event := await queue.get()) is not _DONE:
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+    finally:
+        cancelled.set()
+        await asyncio.shield(future)
@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import wait
+from langchain_core.messages import ToolMessage # type: ignore
+from langchain_core.runnables.config import ContextThreadPoolExecutor, get_config_list # type: ignore
+from langchain_core.tools import StructuredTool # type: ignore
+from langgraph.prebuilt import ToolNode # type: ignore
+from settings import settings
+
+
+TOOL_STEP_TIMEOUT = settings.get_float("TOOL_STEP_TIMEOUT", 20)
+
+# Общий пул для синхронных инструментов: в отличие от пула на один шаг,
+# его не нужно дожидаться целиком, поэтому зависший инструмент не держит шаг
+_tool_pool = ContextThreadPoolExecutor(max_workers=16, thread_name_prefix="tool")
+
+
+def async_tool(coroutine):
+    """
+    Decorator that turns a sync function into a tool with a native async twin.
+
+    The sync function provides the name, the docstring (tool description) and
+    the argument schema; ``coroutine`` is used when the graph runs via
+    ``ainvoke``/``astream`` instead of falling back to a worker thread.
+    """
+    def decorator(func):
+        return StructuredTool.from_function(func=func, coroutine=coroutine)
+    return decorator
+
+
+def _timeout_message(call, timeout: float) -> ToolMessage:
+    return ToolMessage(
+        f"Инструмент {call['name']} не ответил за {timeout:g} с. Ответь по остальным данным "
+        "или предложи пользователю повторить запрос позже.",
+        name=call["name"],
+        tool_call_id=call["id"],
+        status="error",
+    )
+
+
+class DeadlineToolNode(ToolNode):
+    """
+    ToolNode that runs all tool calls of one model step concurrently under a shared deadline.
+
+    When the model requests several tools at once (e.g. ``get_books_universal_search``
+    plus ``get_link_on_book``) they are started together; whatever has not
+    finished after ``step_timeout`` seconds is replaced by an error
+    ``ToolMessage`` so the model can answer with the partial results.
+    Async tools are cancelled on timeout; sync tools keep running in the
+    background pool but their result is dropped.
+    """
+
+    def __init__(self, tools, *, step_timeout: float = TOOL_STEP_TIMEOUT, **kwargs):
+        super().__init__(tools, **kwargs)
+        self.step_timeout = step_timeout
+
+    def _func(self, input, config, *, store):
+        tool_calls, input_type = self._parse_input(input, store)
+        config_list = get_config_list(config, len(tool_calls))
+        futures = [
+            _tool_pool.submit(self._run_one, call, input_type, call_config)
+            for call, call_config in zip(tool_calls, config_list)
+        ]
+        done, _ = wait(futures, timeout=self.step_timeout)
+        outputs = [
+            future.result() if future in done else _timeout_message(call, self.step_timeout)
+            for call, future in zip(tool_calls, futures)
+        ]
+        return self._combine_tool_outputs(outputs, input_type)
+
+    async def _afunc(self, input, config, *, store):
+        tool_calls, input_type = self._parse_input(input, store)
+        if not tool_calls:
+            return self._combine_tool_outputs([], input_type)
+        tasks = [
+            asyncio.ensure_future(self._arun_one(call, input_type, config))
+            for call in tool_calls
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=self.step_timeout)
+        for task in pending:
+            task.cancel()
+        outputs = [
+            task.result() if task in done else _timeout_message(call, self.step_timeout)
+            for call, task in zip(tool_calls, tasks)
+        ]
+        return self._combine_tool_outputs(outputs, input_type)
@@ -1,31 +1,82 @@
+import time
+# Отсчет времени запуска начинаем до тяжелых импортов
+from monitoring.health import startup
 import asyncio
-from dotenv import dotenv_values # type: ignore
+import logging
+import signal
 from aiogram import Bot, Dispatcher, F # type: ignore
 from aiogram.filters import Command # type: ignore
 from aiogram.types import Message # type: ignore
-from llm.agent_llm import agent_llm
-from llm.agent_sberbank import agent_sberbank
-from middleware.check_is_group import AccessMiddleware 
+from settings import settings
+from llm import result_shaping
+from llm.answer_cache import ANSWER_CACHE_ENABLED, answer_cache, record_answer
+from llm.checkpointer import checkpointer_pool
+from llm.compaction import CheckpointJanitor
+from llm.executor import AgentExecutor
+from llm.registry import registry
+from llm.router import ROUTER_ENABLED, route
+from llm.streaming import astream_agent
+from service.duckduck_search import ddg_search, link_prefetcher
+from service.googlebooks import books_cache, prefetcher
+from service.http_client import async_http_client, http_client
+from bot.admission import BUSY_REPLIES, AdmissionRejected, admission
+from bot.sessions import create_session_store, new_session
+from bot.streaming import send_answer, stream_reply
+from bot.webhook import consume, serve_webhook
+from middleware.check_is_group import AccessMiddleware, MembershipCache
+from middleware.tracing import TracingMiddleware
+from monitoring.metrics import metrics
+from monitoring.server import start_monitoring_server
+from monitoring.tracing import TelegramRequestTiming, span, tracing_callback
+from service.knowledge_base import knowledge_base
+from service.sberbank_catalog import catalog
 
-config_dotenv = dotenv_values(".env")
+startup.record("imports", time.perf_counter() - startup.started_at)
 
-TOKEN = config_dotenv.get("BOT_TOKEN")
-CORPORATE_CHAT_ID = config_dotenv.get("CORPORATE_CHAT_ID")
+TOKEN = settings.get("BOT_TOKEN")
+CORPORATE_CHAT_ID = settings.get("CORPORATE_CHAT_ID")
+MEMBERSHIP_TTL = settings.get_float("MEMBERSHIP_TTL", 600)
+MEMBERSHIP_NEGATIVE_TTL = settings.get_float("MEMBERSHIP_NEGATIVE_TTL", 60)
+AGENT_WORKERS = settings.get_int("AGENT_WORKERS", 8)
+AGENT_MAX_CONCURRENCY = settings.get_int("AGENT_MAX_CONCURRENCY", AGENT_WORKERS)
+DB_POOL_ASYNC = settings.get_bool("DB_POOL_ASYNC")
+BOT_MODE = settings.get("BOT_MODE", "polling").lower()
+WEBHOOK_URL = settings.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = settings.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_PORT = settings.get_int("WEBHOOK_PORT", 8080)
+WEBHOOK_SECRET = settings.get("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = settings.get_int("WEBHOOK_WORKERS", 2)
+WEBHOOK_QUEUE_SIZE = settings.get_int("WEBHOOK_QUEUE_SIZE", 1000)
+WEBHOOK_MAX_PENDING = settings.get_int("WEBHOOK_MAX_PENDING", 100)
+WEBHOOK_DRAIN_TIMEOUT = settings.get_float("WEBHOOK_DRAIN_TIMEOUT", 30)
+STREAM_RESPONSES = settings.get_bool("STREAM_RESPONSES", True)
+METRICS_PORT = settings.get_int("METRICS_PORT", 5000)
+LOG_LEVEL = settings.get("LOG_LEVEL", "INFO").upper()
+# После старта поллинга в фоне авторизуемся в GigaChat и собираем агентов, чтобы первый вопрос не ждал
+STARTUP_PREWARM = settings.get_bool("STARTUP_PREWARM", True)
+
+logger = logging.getLogger(__name__)
 
 bot = Bot(token=TOKEN)
+# Каждый вызов Bot API (отправка, редактирование, проверка членства) замеряется отдельной стадией
+bot.session.middleware(TelegramRequestTiming())
 dp = Dispatcher()
-dp.update.middleware(AccessMiddleware(CORPORATE_CHAT_ID))
+membership_cache = MembershipCache(positive_ttl=MEMBERSHIP_TTL, negative_ttl=MEMBERSHIP_NEGATIVE_TTL)
+# Трейс открывается раньше проверки доступа, чтобы она тоже в него попала
+dp.update.middleware(TracingMiddleware())
+access = AccessMiddleware(CORPORATE_CHAT_ID, membership_cache)
+dp.update.middleware(access)
+
+# Пул для запуска агентов вне event loop
+executor = AgentExecutor(max_workers=AGENT_WORKERS, max_concurrency=AGENT_MAX_CONCURRENCY)
 
-# Хранилище для thread_id и истории сообщений каждого пользователя
-user_data = {}
+# Хранилище thread_id и выбранного агента каждого пользователя
+sessions = create_session_store()
 
 @dp.message(Command("start"))
 async def command_start_handler(message: Message) -> None:
-    user_data[message.from_user.id] = {
-        "thread_id": f"{message.from_user.id}_{int(message.date.timestamp())}",
-        "last_message_id": message.message_id,
-        "agent_type": "default"
-    }
+    user_id = message.from_user.id
+    await sessions.set(user_id, new_session(user_id, int(message.date.timestamp()), message.message_id))
     await message.answer(
         "📚 Привет! Я бот-помощник по подбору книг.\n\n"
         "Доступные команды:\n"
@@ -48,23 +99,15 @@ async def help_handler(message: Message) -> None:
 
 @dp.message(Command("new"))
 async def new_dialog_handler(message: Message) -> None:
-    thread_id = f"{message.from_user.id}_{int(message.date.timestamp())}"
-    user_data[message.from_user.id] = {
-        "thread_id": thread_id,
-        "last_message_id": message.message_id,
-        "agent_type": "default"
-    }
+    user_id = message.from_user.id
+    await sessions.set(user_id, new_session(user_id, int(message.date.timestamp()), message.message_id))
     
     await message.answer("✅ Начат новый диалог с обычным агентом. Теперь вы можете отправлять свои запросы для поиска книг.")
 
 @dp.message(Command("sber_new"))
 async def new_sber_dialog_handler(message: Message) -> None:
-    thread_id = f"{message.from_user.id}_{int(message.date.timestamp())}"
-    user_data[message.from_user.id] = {
-        "thread_id": thread_id,
-        "last_message_id": message.message_id,
-        "agent_type": "sberbank"
-    }
+    user_id = message.from_user.id
+    await sessions.set(user_id, new_session(user_id, int(message.date.timestamp()), message.message_id, "sberbank"))
     
     await message.answer("✅ Начат новый диалог с Sberbank агентом. Теперь вы можете отправлять свои запросы для поиска книг в библиотеке Sberbank.")
 
@@ -76,53 +119,269 @@ async def handle_message(message: Message) -> None:
     
     user_id = message.from_user.id
     
+    # Сообщения, пришедшие, пока предыдущий вопрос ждет очереди, уходят агенту вместе с ним
+    try:
+        async with admission.admit(user_id, message.text) as turn:
+            if turn is not None:
+                await answer_turn(message, turn.text)
+    except AdmissionRejected as e:
+        await message.answer(BUSY_REPLIES[e.reason])
+
+async def answer_turn(message: Message, text: str) -> None:
+    user_id = message.from_user.id
+    
     # Если у пользователя нет активной сессии, создаем новую с обычным агентом
-    if user_id not in user_data:
-        thread_id = f"{user_id}_{int(message.date.timestamp())}"
-        user_data[user_id] = {
-            "thread_id": thread_id,
-            "last_message_id": message.message_id,
-            "agent_type": "default"
-        }
+    with span("session"):
+        session = await sessions.get(user_id)
+        if session is None:
+            session = new_session(user_id, int(message.date.timestamp()), message.message_id)
+            await sessions.set(user_id, session)
+            created = True
+        else:
+            # Обновляем ID последнего сообщения
+            session = await sessions.update(user_id, last_message_id=message.message_id)
+            created = False
+    if created:
         await message.answer("ℹ️ Автоматически начат новый диалог с обычным агентом.")
     
-    # Обновляем ID последнего сообщения
-    user_data[user_id]["last_message_id"] = message.message_id
+    thread_id = session["thread_id"]
+    # tracing_callback замеряет каждый вызов модели и инструмента агента
+    # turn_id отделяет ходы одного диалога: повторы книг shape_books убирает только внутри хода
+    config = {"configurable": {"thread_id": thread_id, "turn_id": message.message_id, "recursion_limit": 10},
+              "callbacks": [tracing_callback]}
+    agent_type = session.get("agent_type", "default")
     
-    thread_id = user_data[user_id]["thread_id"]
-    config = {"configurable": {"thread_id": thread_id, "recursion_limit": 10}}
-    agent_type = user_data[user_id].get("agent_type", "default")
+    turns = session.get("turns", 0)
     
     try:
-        # Отправляем "Печатает..." как статус
-        await bot.send_chat_action(message.chat.id, "typing")
+        # Простые вопросы (жанры, доступность книги, ссылки на покупку) отвечаем по шаблону без GigaChat
+        routed = None
+        if ROUTER_ENABLED:
+            with span("router"):
+                routed = await executor.run(user_id, route, agent_type, text)
+        
+        # Похожий первый вопрос диалога уже задавали: отвечаем из кэша без GigaChat
+        cached = None
+        if ANSWER_CACHE_ENABLED and turns == 0 and routed is None:
+            with span("answer_cache"):
+                cached = answer_cache.lookup(agent_type, text)
         
-        # Вызываем соответствующий агент в зависимости от типа
-        if agent_type == "sberbank":
-            resp = agent_sberbank(message.text, config)
+        if routed is not None:
+            sent_msg = await send_answer(message, routed.answer)
+            await executor.run(user_id, record_answer, agent_type, text, routed.answer, config,
+                               source="router", intent=routed.intent, confidence=routed.confidence)
+            resp = routed.answer
+        elif cached is not None:
+            sent_msg = await send_answer(message, cached)
+            await executor.run(user_id, record_answer, agent_type, text, cached, config, source="answer_cache")
+            resp = cached
+        elif STREAM_RESPONSES:
+            # Ответ дописывается в сообщение по мере генерации, статусы показывают вызовы инструментов
+            events = astream_agent(agent_type, text, config, pool=executor.pool)
+            sent_msg, resp = await executor.run(user_id, stream_reply, message, events)
         else:
-            resp = agent_llm(message.text, config)
+            # Отправляем "Печатает..." как статус
+            await bot.send_chat_action(message.chat.id, "typing")
+            
+            # Вызываем соответствующий агент в зависимости от типа
+            # С асинхронным чекпоинтером граф идет через ainvoke прямо в event loop
+            invoke = registry.ainvoke if DB_POOL_ASYNC else registry.invoke
+            resp = await executor.run(user_id, invoke, agent_type, text, config)
+            
+            # Отправляем ответ пользователю, длинные ответы делим на части
+            sent_msg = await send_answer(message, resp)
         
-        # Отправляем ответ пользователю
-        try:
-            sent_msg = await message.answer(resp, parse_mode="Markdown")
-        except:
-            # Если Markdown разметка некорректна, отправляем как обычный текст
-            sent_msg = await message.answer(resp)
-        user_data[user_id]["last_message_id"] = sent_msg.message_id
+        if ANSWER_CACHE_ENABLED and turns == 0 and cached is None and routed is None:
+            answer_cache.store(agent_type, text, resp)
+        await sessions.update(user_id, last_message_id=sent_msg.message_id, turns=turns + 1)
         
     except Exception as e:
         error_msg = await message.answer(f"Произошла ошибка: {str(e)}")
-        user_data[user_id]["last_message_id"] = error_msg.message_id
         # В случае ошибки создаем новую сессию
-        user_data[user_id]["thread_id"] = f"{user_id}_{int(message.date.timestamp())}"
+        await sessions.update(
+            user_id,
+            last_message_id=error_msg.message_id,
+            thread_id=f"{user_id}_{int(message.date.timestamp())}",
+            turns=0,
+        )
+
+def register_metrics(janitor=None) -> None:
+    # Счетчики компонентов выгружаются в /metrics как есть, без отдельного учета
+    metrics.add_stats("bot_executor", executor.stats)
+    metrics.add_stats("bot_admission", admission.snapshot)
+    metrics.add_stats("bot_db_pool", checkpointer_pool.stats)
+    metrics.add_stats("bot_cache", books_cache.stats, cache="google_books")
+    metrics.add_stats("bot_cache", ddg_search.cache.stats, cache="duckduckgo")
+    metrics.add_stats("bot_cache", answer_cache.stats, cache="answers")
+    metrics.add_stats("bot_cache", membership_cache.stats, cache="membership")
+    metrics.add_stats("bot_cache", catalog.status_cache.stats, cache="sberbank_status")
+    metrics.add_stats("bot_http", http_client.stats, client="sync")
+    metrics.add_stats("bot_http", async_http_client.stats, client="async")
+    metrics.add_stats("bot_http", lambda: {"open_circuits": http_client.open_circuits()}, client="sync")
+    metrics.add_stats("bot_http", lambda: {"open_circuits": async_http_client.open_circuits()}, client="async")
+    metrics.add_stats("bot_sberbank_catalog", catalog.stats)
+    metrics.add_stats("bot_sberbank_catalog", lambda: {"version": catalog.version})
+    metrics.add_stats("bot_duckduckgo", ddg_search.stats)
+    metrics.add_stats("bot_link_prefetch", link_prefetcher.stats)
+    metrics.add_stats("bot_knowledge_base", knowledge_base.snapshot)
+    metrics.add_stats("bot_tool_output", result_shaping.stats)
+    metrics.add_stats("bot_prefetch", prefetcher.stats)
+    metrics.add_stats("bot_startup", startup.stats)
+    # Очистка чекпоинтов работает только в одном процессе
+    if janitor is not None:
+        metrics.add_stats("bot_checkpoint_janitor", janitor.stats)
+
+def reload_agents() -> None:
+    # Выполняется в пуле по SIGHUP: результат никто не ждет, поэтому ошибку пишем в лог здесь
+    try:
+        registry.reload()
+    except Exception:
+        logger.exception("Agent reload failed")
+
+async def start_services(primary: bool = True, workers: int = 1):
+    # primary - процесс, который выполняет фоновые задачи, общие для всех процессов бота
+    # Открываем пул Postgres при старте; GigaChat и агенты поднимаются при первом вопросе или в prewarm()
+    with startup.stage("checkpointer"):
+        if DB_POOL_ASYNC:
+            await checkpointer_pool.aopen()
+            startup.add_check("postgres", checkpointer_pool.ahealth_check)
+        else:
+            await asyncio.to_thread(checkpointer_pool.open)
+            startup.add_check("postgres", lambda: asyncio.to_thread(checkpointer_pool.health_check))
+    # Таблица сессий живет в том же Postgres, что и чекпоинты
+    with startup.stage("sessions"):
+        await sessions.start()
+        await sessions.purge()
+    loop = asyncio.get_running_loop()
+    try:
+        # kill -HUP <pid> перечитывает промпты и инструменты без перезапуска
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.run_in_executor(None, reload_agents))
+    except (NotImplementedError, AttributeError):
+        pass
+    # Фоновая очистка брошенных диалогов и устаревших чекпоинтов (одна на все процессы)
+    janitor = None
+    if primary:
+        janitor = CheckpointJanitor()
+        janitor.start()
+    # Каталог Сбербанка переносит в базу книг один процесс, чтобы воркеры не писали его одновременно
+    if primary:
+        knowledge_base.start()
+    # Каталог Сбербанка держим локально и обновляем в фоне
+    catalog.start()
+    # Популярные жанры и запросы Google Books держим прогретыми; в памяти у каждого
+    # процесса свой кэш, поэтому при нескольких воркерах прогрев нужен общий SQLite-кэш
+    if primary and (workers == 1 or books_cache.backend is not None):
+        prefetcher.start()
+    return janitor
+
+async def prewarm() -> None:
+    # Авторизация в GigaChat и сборка графов (импорт langgraph) уходят в потоки, бот уже отвечает
+    try:
+        with startup.stage("gigachat"):
+            await asyncio.to_thread(registry.start)
+        for agent_type in registry.modules:
+            with startup.stage(f"agent:{agent_type}"):
+                await asyncio.to_thread(registry.get, agent_type)
+        startup.warm = True
+        logger.info("Agents warmed up: %s", startup.stages)
+    except Exception as e:
+        logger.warning("Prewarm failed, agents will be built on first use: %s", e)
+
+async def begin_serving() -> None:
+    # async: синхронные startup-хендлеры aiogram выполняет в потоке, где нет event loop
+    startup.mark_ready()
+    logger.info("Ready in %.2fs", startup.ready_after)
+    if STARTUP_PREWARM:
+        # Ссылка на задачу хранится, чтобы ее не собрал сборщик мусора
+        begin_serving.task = asyncio.create_task(prewarm())
+
+async def stop_services(janitor) -> None:
+    if janitor is not None:
+        janitor.stop()
+    catalog.stop()
+    prefetcher.stop()
+    link_prefetcher.shutdown()
+    executor.shutdown(wait=False)
+    await registry.aclose()
+    await async_http_client.close()
+
+def allowed_updates() -> list:
+    # chat_member нужен для инвалидации кэша членства (бот должен быть админом чата)
+    return dp.resolve_used_update_types() + ["chat_member"]
+
+async def polling():
+    # /health отвечает уже во время запуска, /ready - после старта поллинга
+    metrics_server = await start_monitoring_server(METRICS_PORT)
+    try:
+        janitor = await start_services()
+        register_metrics(janitor)
+        dp.startup.register(begin_serving)
+        try:
+            await dp.start_polling(bot, allowed_updates=allowed_updates())
+        finally:
+            await stop_services(janitor)
+    finally:
+        await metrics_server.cleanup()
+
+async def webhook_worker(index: int, updates) -> None:
+    # У каждого процесса свои метрики и проверки: воркер i отдает их на METRICS_PORT + 1 + i
+    metrics_server = await start_monitoring_server(METRICS_PORT + 1 + index)
+    # Лимиты допуска заданы на весь бот, а AdmissionController у каждого процесса свой
+    admission.max_in_flight = max(1, admission.max_in_flight // WEBHOOK_WORKERS)
+    admission.max_queue = max(1, admission.max_queue // WEBHOOK_WORKERS)
+    try:
+        janitor = await start_services(primary=index == 0, workers=WEBHOOK_WORKERS)
+        register_metrics(janitor)
+        await begin_serving()
+        try:
+            await consume(updates, lambda update: dp.feed_raw_update(bot, update), max_pending=WEBHOOK_MAX_PENDING)
+        finally:
+            await stop_services(janitor)
+            await bot.session.close()
+    finally:
+        await metrics_server.cleanup()
+
+def run_webhook_worker(index: int, updates) -> None:
+    logging.basicConfig(level=LOG_LEVEL)
+    asyncio.run(webhook_worker(index, updates))
+
+async def webhook():
+    async def register_webhook():
+        await bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            allowed_updates=allowed_updates(),
+            secret_token=WEBHOOK_SECRET,
+        )
+        await bot.session.close()
+        startup.mark_ready()
+
+    # Приемник вебхуков отдает на METRICS_PORT свои счетчики и размеры очередей воркеров
+    metrics_server = await start_monitoring_server(METRICS_PORT)
+    # Апдейты одного пользователя всегда уходят в один и тот же процесс
+    try:
+        await serve_webhook(
+            run_webhook_worker,
+            WEBHOOK_WORKERS,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            drain_timeout=WEBHOOK_DRAIN_TIMEOUT,
+            on_startup=register_webhook,
+        )
+    finally:
+        await metrics_server.cleanup()
 
 async def main():
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        await webhook()
+    else:
+        await polling()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL)
     try:
-        print("Bot is running...")
+        logger.info("Bot is running...")
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("Bot stopped.")
\ No newline at end of file
+        logger.info("Bot stopped.")
\ No newline at end of file
@@ -1,10 +1,81 @@
+import asyncio
+import time
+from collections import OrderedDict
+import logging
 from aiogram import BaseMiddleware # type: ignore
-from aiogram.types import Message, Update # type: ignore
+from aiogram.exceptions import TelegramBadRequest # type: ignore
+from aiogram.types import ChatMemberUpdated, Message, Update # type: ignore
 from typing import Callable, Dict, Any, Awaitable
+from monitoring.tracing import span
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ['member', 'administrator', 'creator']
+
+
+class MembershipCache:
+    """
+    LRU-кэш результатов проверки членства в корпоративном чате.
+
+    Участник кэшируется на positive_ttl, не участник - на более короткий
+    negative_ttl, чтобы только что добавленный в чат человек быстро получил
+    доступ. Одновременные проверки одного пользователя объединяются в один
+    запрос к Telegram.
+    """
+
+    def __init__(self, positive_ttl: float = 600, negative_ttl: float = 60, maxsize: int = 10000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0, "errors": 0}
+        self._data: OrderedDict = OrderedDict()
+        self._in_flight: Dict[int, asyncio.Future] = {}
+
+    def get(self, user_id: int) -> bool | None:
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        is_member, expires_at = entry
+        if time.monotonic() > expires_at:
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return is_member
+
+    def set(self, user_id: int, is_member: bool) -> None:
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._data[user_id] = (is_member, time.monotonic() + ttl)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_check(self, user_id: int, check: Callable[[], Awaitable[bool | None]]) -> bool:
+        """Результат check() кэшируется; None (проверка не удалась) не кэшируется и считается отказом."""
+        cached = self.get(user_id)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+        if user_id in self._in_flight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._in_flight[user_id])
+        self.stats["misses"] += 1
+        future = asyncio.ensure_future(check())
+        self._in_flight[user_id] = future
+        try:
+            is_member = await asyncio.shield(future)
+            if is_member is None:
+                self.stats["errors"] += 1
+                return False
+            self.set(user_id, is_member)
+            return is_member
+        finally:
+            self._in_flight.pop(user_id, None)
+
 
 class AccessMiddleware(BaseMiddleware):
-    def __init__(self, corporate_chat_id: str):
+    def __init__(self, corporate_chat_id: str, cache: MembershipCache | None = None):
         self.corporate_chat_id = corporate_chat_id
+        self.cache = cache or MembershipCache()
 
     async def __call__(
         self,
@@ -12,6 +83,10 @@ class AccessMiddleware(BaseMiddleware):
         event: Update,
         data: Dict[str, Any]
     ) -> Any:
+        # Изменения состава корпоративного чата сразу обновляют кэш членства
+        if event.chat_member:
+            self.on_chat_member(event.chat_member)
+
         # Получаем сообщение из апдейта
         message = self.get_message(event)
         if not message or not message.text:
@@ -22,7 +97,9 @@ class AccessMiddleware(BaseMiddleware):
             return await handler(event, data)
             
         # Для всех остальных команд проверяем доступ
-        if not await self.is_user_in_chat(message.from_user.id, data['bot']):
+        with span("access_check"):
+            is_member = await self.is_user_in_chat(message.from_user.id, data['bot'])
+        if not is_member:
             await message.answer(
                 "🚫 Доступ запрещён.\n\n"
                 "Для использования бота необходимо быть участником корпоративного чата.\n"
@@ -40,12 +117,27 @@ class AccessMiddleware(BaseMiddleware):
             return update.callback_query.message
         return None
 
+    def on_chat_member(self, update: ChatMemberUpdated) -> None:
+        """Обновляет кэш по апдейту chat_member из корпоративного чата"""
+        if str(update.chat.id) != str(self.corporate_chat_id):
+            return
+        self.cache.stats["invalidations"] += 1
+        self.cache.set(update.new_chat_member.user.id, update.new_chat_member.status in MEMBER_STATUSES)
+
     async def is_user_in_chat(self, user_id: int, bot) -> bool:
+        return await self.cache.get_or_check(user_id, lambda: self.fetch_membership(user_id, bot))
+
+    async def fetch_membership(self, user_id: int, bot) -> bool | None:
+        """Статус пользователя в чате; None, если Telegram не ответил (сеть, flood wait) - такое не кэшируется."""
         try:
             member = await bot.get_chat_member(
                 chat_id=self.corporate_chat_id,
                 user_id=user_id
             )
-            return member.status in ['member', 'administrator', 'creator']
-        except Exception:
-            return False
\ No newline at end of file
+            return member.status in MEMBER_STATUSES
+        except TelegramBadRequest:
+            # Telegram не знает такого участника
+            return False
+        except Exception as e:
+            logger.warning("Membership check for %s failed: %s", user_id, e)
+            return None
\ No newline at end of file
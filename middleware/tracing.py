@@ -0,0 +1,17 @@
+from aiogram import BaseMiddleware # type: ignore
+from aiogram.types import Update # type: ignore
+from typing import Callable, Dict, Any, Awaitable
+from monitoring.tracing import trace
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Открывает трейс на каждый апдейт: все стадии его обработки попадают в один трейс."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        with trace(event.event_type):
+            return await handler(event, data)
@@ -0,0 +1,71 @@
+import re
+import time
+from contextlib import contextmanager
+
+
+class StartupTracker:
+    """
+    Этапы запуска процесса и его состояние для ``/health`` и ``/ready``.
+
+    Процесс жив (liveness), пока отвечает event loop. Готов (readiness),
+    когда открыт пул Postgres и бот начал принимать апдейты; GigaChat и
+    агенты при этом могут еще прогреваться в фоне (``warm``). После этого
+    ``/ready`` дополнительно выполняет проверки зависимостей из ``add_check``.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: dict = {}
+        self.ready_after = None
+        self.warm = False
+        self.failed: dict = {}
+        self.checks: dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.failed[name] = str(e)
+            raise
+        finally:
+            self.stages[name] = round(time.perf_counter() - started, 3)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = round(seconds, 3)
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after is not None
+
+    def mark_ready(self) -> None:
+        if self.ready_after is None:
+            self.ready_after = round(time.perf_counter() - self.started_at, 3)
+
+    def add_check(self, name: str, check) -> None:
+        """Регистрирует async-проверку ``check() -> bool`` для ``/ready``."""
+        self.checks[name] = check
+
+    async def run_checks(self) -> dict:
+        return {name: await check() for name, check in self.checks.items()}
+
+    def stats(self) -> dict:
+        # Для /metrics: bot_startup_ready, bot_startup_agent_default_seconds и т.п.
+        values = {"ready": self.ready, "warm": self.warm, "ready_after_seconds": self.ready_after or 0}
+        for name, seconds in self.stages.items():
+            values[re.sub(r"\W", "_", name) + "_seconds"] = seconds
+        return values
+
+    def snapshot(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "starting",
+            "warm": self.warm,
+            "uptime_s": round(time.perf_counter() - self.started_at, 3),
+            "ready_after_s": self.ready_after,
+            "stages_s": dict(self.stages),
+            "failed": dict(self.failed),
+        }
+
+
+startup = StartupTracker()
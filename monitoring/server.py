@@ -0,0 +1,43 @@
+from aiohttp import web # type: ignore
+from monitoring.health import startup
+from monitoring.metrics import metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    # Liveness: отвечаем 200, пока жив event loop, вместе с разбивкой времени запуска
+    return web.json_response(startup.snapshot())
+
+
+async def ready_handler(request: web.Request) -> web.Response:
+    snapshot = startup.snapshot()
+    if not startup.ready:
+        return web.json_response(snapshot, status=503)
+    # Готовый процесс без доступа к Postgres не должен получать трафик
+    snapshot["checks"] = await startup.run_checks()
+    return web.json_response(snapshot, status=200 if all(snapshot["checks"].values()) else 503)
+
+
+async def start_monitoring_server(port: int, host: str = "0.0.0.0") -> web.AppRunner:
+    """
+    Поднимает aiohttp-сервер с ``/metrics`` в формате Prometheus, ``/health`` и ``/ready``.
+
+    Запускается до остальных сервисов, чтобы проверки docker-compose
+    получали ответ уже во время старта.
+
+    Returns:
+        web.AppRunner: Остановить сервер - ``await runner.cleanup()``.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/health", health_handler)
+    app.router.add_get("/ready", ready_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,157 @@
+import json
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware # type: ignore
+from langchain_core.callbacks import BaseCallbackHandler # type: ignore
+from settings import settings
+from monitoring.metrics import metrics
+
+
+TRACE_SAMPLE_RATE = settings.get_float("TRACE_SAMPLE_RATE", 0.1)
+
+logger = logging.getLogger("trace")
+
+STAGE_SECONDS = metrics.histogram("bot_stage_duration_seconds", "Duration of request processing stages")
+STAGE_ERRORS = metrics.counter("bot_stage_errors_total", "Failed request processing stages")
+REQUESTS = metrics.counter("bot_requests_total", "Processed Telegram updates")
+LLM_TOKENS = metrics.counter("bot_llm_tokens_total", "GigaChat tokens by kind (prompt/completion)")
+
+_current_trace: ContextVar = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """
+    Спаны одного апдейта Telegram.
+
+    Длительности стадий пишутся в гистограммы всегда, а сами спаны
+    копятся и выводятся в лог одной JSON-строкой только у ``sampled``
+    трейсов (доля задается TRACE_SAMPLE_RATE).
+    """
+
+    def __init__(self, kind: str, sampled: bool):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans: list = []
+
+    def add(self, stage: str, started: float, duration: float, **attrs) -> None:
+        if self.sampled:
+            self.spans.append({"stage": stage, "start_ms": round((started - self.started) * 1000, 1),
+                               "ms": round(duration * 1000, 1), **attrs})
+
+    def finish(self, status: str = "ok") -> None:
+        duration = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(duration, stage=self.kind)
+        REQUESTS.inc(kind=self.kind, status=status)
+        if self.sampled:
+            logger.info(json.dumps({"trace_id": self.id, "kind": self.kind, "status": status,
+                                    "ms": round(duration * 1000, 1), "spans": self.spans}, ensure_ascii=False))
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(kind: str, sample_rate: float = TRACE_SAMPLE_RATE):
+    """Начинает трейс апдейта в текущем контексте (потоки агента наследуют его через copy_context)."""
+    current = Trace(kind, sampled=random.random() < sample_rate)
+    token = _current_trace.set(current)
+    status = "ok"
+    try:
+        yield current
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        current.finish(status)
+
+
+def record(stage: str, started: float, duration: float, error: bool = False, **attrs) -> None:
+    STAGE_SECONDS.observe(duration, stage=stage)
+    if error:
+        STAGE_ERRORS.inc(stage=stage)
+    current = current_trace()
+    if current is not None:
+        current.add(stage, started, duration, **({"error": True} if error else {}), **attrs)
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Замеряет стадию: гистограмма bot_stage_duration_seconds{stage} и спан текущего трейса."""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield attrs
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(stage, started, time.perf_counter() - started, error=error, **attrs)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback, замеряющий каждый вызов модели и инструмента агента.
+
+    Вызовы модели пишутся как стадия ``model`` с расходом токенов из
+    usage_metadata GigaChat, вызовы инструментов - как ``tool:<имя>``.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._runs: dict = {}
+
+    def _start(self, run_id, stage: str) -> None:
+        self._runs[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id, error: bool = False, **attrs) -> None:
+        stage, started = self._runs.pop(run_id, (None, None))
+        if stage is not None:
+            record(stage, started, time.perf_counter() - started, error=error, **attrs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._start(run_id, "model")
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None and getattr(message, "usage_metadata", None):
+                    usage = message.usage_metadata
+        prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        if prompt or completion:
+            LLM_TOKENS.inc(prompt, kind="prompt")
+            LLM_TOKENS.inc(completion, kind="completion")
+        self._end(run_id, prompt_tokens=prompt, completion_tokens=completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs) -> None:
+        self._start(run_id, f"tool:{(serialized or {}).get('name') or kwargs.get('name', 'unknown')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=True)
+
+
+tracing_callback = TracingCallbackHandler()
+
+
+class TelegramRequestTiming(BaseRequestMiddleware):
+    """Middleware сессии aiogram: каждый вызов Bot API - стадия ``telegram:<метод>``."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram:{type(method).__name__}"):
+            return await make_request(bot, method)
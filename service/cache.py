@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Общий пул для фонового обновления устаревших записей
+_revalidate_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-revalidate")
+
+
+def make_key(*parts, **params) -> str:
+    """
+    Строит ключ кэша из нормализованного запроса и параметров.
+
+    Строки приводятся к нижнему регистру и лишние пробелы схлопываются,
+    поэтому "Дюна " и "дюна" попадают в одну запись.
+    """
+    normalized = [" ".join(str(part).lower().split()) for part in parts]
+    return json.dumps([normalized, params], ensure_ascii=False, sort_keys=True)
+
+
+class SQLiteBackend:
+    """Персистентное хранилище записей кэша в SQLite (значения сериализуются в JSON)."""
+
+    def __init__(self, path: str, table: str = "cache"):
+        self.table = table
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, ttl REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, stored_at, ttl FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, key: str, value, stored_at: float, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at, ttl) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), stored_at, ttl),
+            )
+            self._conn.commit()
+
+    def purge(self, max_age: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE stored_at + ttl + ? < ?", (max_age, time.time())
+            )
+            self._conn.commit()
+
+
+class TTLCache:
+    """
+    LRU-кэш с TTL для ответов внешних API.
+
+    Пустые результаты кэшируются отдельно с коротким ``negative_ttl``.
+    Просроченная запись еще ``stale_ttl`` секунд отдается сразу, а обновляется
+    в фоне (stale-while-revalidate). Размер в памяти ограничен ``maxsize``,
+    при вытеснении удаляется давно не использованная запись. Опционально
+    записи дублируются в ``backend`` (например, SQLiteBackend) и переживают
+    перезапуск; каждые ``purge_every`` записей из backend удаляются записи,
+    которые уже нельзя отдать даже как устаревшие.
+
+    Args:
+        maxsize: Максимальное количество записей в памяти.
+        ttl: Время жизни обычной записи в секундах.
+        negative_ttl: Время жизни пустого результата в секундах.
+        stale_ttl: Сколько секунд после истечения TTL запись еще можно отдавать.
+        backend: Персистентное хранилище или None.
+        purge_every: Через сколько записей чистить backend.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, negative_ttl: float = 300,
+                 stale_ttl: float = 600, backend=None, purge_every: int = 500):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend
+        self.purge_every = purge_every
+        self.stats = {"hits": 0, "misses": 0, "stale_hits": 0, "negative_hits": 0, "evictions": 0, "purges": 0}
+        self._writes = 0
+        self._data: OrderedDict = OrderedDict()
+        self._revalidating: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: str):
+        entry = self._data.get(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+            return entry
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self._store(key, *entry)
+        return entry
+
+    def _store(self, key: str, value, stored_at: float, ttl: float) -> None:
+        self._data[key] = (value, stored_at, ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def set(self, key: str, value, is_negative: bool = False) -> None:
+        ttl = self.negative_ttl if is_negative else self.ttl
+        stored_at = time.time()
+        with self._lock:
+            self._store(key, value, stored_at, ttl)
+        if self.backend is not None:
+            self.backend.set(key, value, stored_at, ttl)
+            with self._lock:
+                self._writes += 1
+                purge = self._writes % self.purge_every == 0
+            if purge:
+                self.backend.purge(self.stale_ttl)
+                self.stats["purges"] += 1
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any],
+                     is_negative: Callable[[Any], bool] = lambda value: not value,
+                     should_cache: Callable[[Any], bool] = lambda value: True) -> Any:
+        """
+        Возвращает значение из кэша или вызывает fetch() и сохраняет результат.
+
+        is_negative определяет пустой результат (кэшируется на negative_ttl),
+        should_cache отсекает ответы, которые нельзя кэшировать (например, ошибки API).
+        """
+        with self._lock:
+            entry = self._lookup(key)
+        if entry is not None:
+            value, stored_at, ttl = entry
+            age = time.time() - stored_at
+            if age <= ttl:
+                self.stats["hits"] += 1
+                if is_negative(value):
+                    self.stats["negative_hits"] += 1
+                return value
+            if age <= ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._revalidate(key, fetch, is_negative, should_cache)
+                return value
+        self.stats["misses"] += 1
+        value = fetch()
+        if should_cache(value):
+            self.set(key, value, is_negative=is_negative(value))
+        return value
+
+    async def aget_or_fetch(self, key: str, afetch: Callable[[], Any],
+                            is_negative: Callable[[Any], bool] = lambda value: not value,
+                            should_cache: Callable[[Any], bool] = lambda value: True) -> Any:
+        """Асинхронный вариант get_or_fetch: afetch() - корутина, фоновое обновление идет задачей в loop."""
+        with self._lock:
+            entry = self._lookup(key)
+        if entry is not None:
+            value, stored_at, ttl = entry
+            age = time.time() - stored_at
+            if age <= ttl:
+                self.stats["hits"] += 1
+                if is_negative(value):
+                    self.stats["negative_hits"] += 1
+                return value
+            if age <= ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._arevalidate(key, afetch, is_negative, should_cache)
+                return value
+        self.stats["misses"] += 1
+        value = await afetch()
+        if should_cache(value):
+            self.set(key, value, is_negative=is_negative(value))
+        return value
+
+    def _arevalidate(self, key: str, afetch, is_negative, should_cache) -> None:
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        async def task():
+            try:
+                value = await afetch()
+                if should_cache(value):
+                    self.set(key, value, is_negative=is_negative(value))
+            except Exception as e:
+                logger.warning("Cache revalidation failed: %s", e)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        asyncio.get_running_loop().create_task(task())
+
+    def _revalidate(self, key: str, fetch, is_negative, should_cache) -> None:
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def task():
+            try:
+                value = fetch()
+                if should_cache(value):
+                    self.set(key, value, is_negative=is_negative(value))
+            except Exception as e:
+                logger.warning("Cache revalidation failed: %s", e)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        _revalidate_pool.submit(task)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
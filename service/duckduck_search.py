@@ -1,5 +1,145 @@
-from duckduckgo_search import DDGS # type: ignore
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
+from settings import settings
+from service.cache import TTLCache, make_key
+from service.googlebooks import search_google
+from service.http_client import TokenBucket
+from service.sberbank_search import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+# duckduckgo_search тянет за собой много зависимостей, поэтому импортируется при первом запросе
+DDGS = None
+
+
+def _create_ddgs():
+    global DDGS
+    if DDGS is None:
+        from duckduckgo_search import DDGS # type: ignore
+    return DDGS()
+
+
+class DuckDuckGoSearch:
+    """
+    Общий клиент поиска DuckDuckGo для всех пользователей бота.
+
+    Экземпляр DDGS переиспользуется между запросами (свой в каждом потоке,
+    так что запросы идут параллельно и не ждут друг друга), частота обращений
+    ограничивается TokenBucket (при всплеске запрос ждет токен не дольше
+    ``wait`` секунд), одинаковые одновременные запросы выполняются один раз,
+    а результаты кэшируются по (запрос, сайт, регион, период). Если DuckDuckGo
+    не ответил или ограничил частоту, используется search_google; такие
+    результаты кэшируются только на короткий negative_ttl.
+
+    Args:
+        rate: Запросов к DuckDuckGo в секунду.
+        burst: Сколько запросов можно выполнить подряд без ожидания.
+        wait: Сколько секунд запрос может ждать своей очереди.
+        cache: Кэш результатов.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 3, wait: float = 5, cache: TTLCache | None = None):
+        self.bucket = TokenBucket(rate, burst)
+        self.wait = wait
+        self.cache = cache or TTLCache()
+        self.stats = {"queries": 0, "coalesced": 0, "throttled": 0, "fallbacks": 0, "speculative_failed": 0}
+        self._local = threading.local()
+        self._in_flight: dict = {}
+        self._lock = threading.Lock()
+
+    def _text(self, full_query: str, wait: float, **kwargs) -> list:
+        if not self.bucket.acquire(wait):
+            self.stats["throttled"] += 1
+            raise RuntimeError("DuckDuckGo rate limit: no free slot")
+        self.stats["queries"] += 1
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = _create_ddgs()
+        try:
+            return client.text(full_query, **kwargs)
+        except Exception:
+            # После ошибки (например, ratelimit) этот поток начинает с новой сессией
+            self._local.client = None
+            raise
+
+    def _fetch(self, query: str, full_query: str, site: str, status: bool, speculative: bool, **kwargs) -> dict:
+        try:
+            # Спекулятивный запрос берет только свободный токен и не заставляет ждать пользователей
+            wait = 0 if speculative else self.wait
+            return {"provider": "duckduckgo", "results": self._text(full_query, wait, **kwargs)}
+        except Exception as e:
+            if speculative:
+                raise
+            logger.warning("DuckDuckGo search failed, falling back to Google: %s", e)
+            self.stats["fallbacks"] += 1
+            urls = search_google(query, site=site, status=status)
+            return {
+                "provider": "google",
+                "results": [{"title": "", "href": url, "body": ""} for url in urls],
+                "error": str(e),
+            }
+
+    def search(self, query: str, full_query: str, site: str = None, status: bool = None,
+               speculative: bool = False, **kwargs) -> dict | None:
+        """
+        Возвращает {"provider", "results"[, "error"]} из кэша, общего запроса в полете или сети.
+
+        ``speculative=True`` - запрос на будущее (LinkPrefetcher): он не ждет
+        токен и не уходит в search_google, а при неудаче возвращает None.
+        """
+        key = make_key(query, site=site, status=bool(status), **kwargs)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            self.stats["coalesced"] += 1
+            value = future.result()
+            if value is None and not speculative:
+                # Спекулятивный запрос, к которому мы присоединились, не выполнился: ищем сами
+                return self.search(query, full_query, site=site, status=status, **kwargs)
+            return value
+
+        try:
+            value = self.cache.get_or_fetch(
+                key,
+                lambda: self._fetch(query, full_query, site, status, speculative, **kwargs),
+                is_negative=lambda value: value["provider"] != "duckduckgo" or not value["results"],
+                should_cache=lambda value: bool(value["results"]),
+            )
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            if speculative and isinstance(e, Exception):
+                self.stats["speculative_failed"] += 1
+                future.set_result(None)
+                return None
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+ddg_search = DuckDuckGoSearch(
+    rate=settings.get_float("DDG_RATE", 1.0),
+    burst=settings.get_int("DDG_BURST", 3),
+    wait=settings.get_float("DDG_WAIT", 5),
+    cache=TTLCache(
+        maxsize=settings.get_int("DDG_CACHE_SIZE", 512),
+        ttl=settings.get_float("DDG_CACHE_TTL", 6 * 3600),
+        negative_ttl=settings.get_float("DDG_CACHE_NEGATIVE_TTL", 300),
+        stale_ttl=0,
+    ),
+)
+
 
 def duckduckgo_search(
     query: str,
@@ -9,11 +149,12 @@ def duckduckgo_search(
     timelimit: str = "y",
     max_results: int = 5,
     json_indent: int = 2,
-    status: bool = None
+    status: bool = None,
+    speculative: bool = False
 ) -> str:
     """
     Выполняет поиск через DuckDuckGo и возвращает результаты в формате JSON.
-    
+
     Args:
         query: Поисковый запрос
         site: Ограничить поиск конкретным сайтом (например 'ozon.ru')
@@ -22,7 +163,8 @@ def duckduckgo_search(
         timelimit: Ограничение по времени ('d', 'w', 'm', 'y')
         max_results: Максимальное количество результатов
         json_indent: Отступ для форматирования JSON
-    
+        speculative: Запрос на будущее, только прогревает кэш (см. LinkPrefetcher)
+
     Returns:
         Строка с результатами поиска в формате JSON
     """
@@ -30,22 +172,155 @@ def duckduckgo_search(
         full_query = f"Купить книгу {query}, site:{site}" if site else query
     else:
         full_query = f"{query}, site:{site}" if site else query
-    
+
     try:
-        # Выполняем поиск
-        results = DDGS().text(
+        # Выполняем поиск через общий клиент с кэшем и ограничением частоты
+        response = ddg_search.search(
+            query,
             full_query,
+            site=site,
+            status=status,
             region=region,
             safesearch=safesearch,
             timelimit=timelimit,
-            max_results=max_results
+            max_results=max_results,
+            speculative=speculative
         )
-        print("Query: " + full_query)
-        print(f"DuckDuckGO: {results}")
-        return results
-    
+        if response is None:
+            return None
+        logger.debug("Query: %s, %s: %s", full_query, response["provider"], response["results"])
+        if not response["results"] and "error" in response:
+            return json.dumps({"error": response["error"]}, ensure_ascii=False, indent=json_indent)
+        return response["results"]
+
     except Exception as e:
         # В случае ошибки возвращаем JSON с описанием ошибки
         return json.dumps({"error": str(e)}, ensure_ascii=False, indent=json_indent)
-    
+
+
+async def aduckduckgo_search(query: str, **kwargs) -> str:
+    """
+    Асинхронный вариант duckduckgo_search.
+
+    У DDGS нет асинхронного API, поэтому запрос выполняется в отдельном потоке,
+    не блокируя event loop. Аргументы те же, что у duckduckgo_search.
+    """
+    return await asyncio.to_thread(duckduckgo_search, query, **kwargs)
+
+
+LINK_PREFETCH_TOP = settings.get_int("LINK_PREFETCH_TOP", 3)
+LINK_PREFETCH_TTL = settings.get_float("LINK_PREFETCH_TTL", 120)
+LINK_PREFETCH_SITE = "ozon.ru"
+
+
+def _stems(text: str) -> set:
+    # Основы слов тем же стеммером, что и поиск по каталогу: "Стругацкие" и "Стругацкий" совпадают
+    return set(tokenize(text))
+
+
+# Слова, которые модель добавляет к названию в запросе ссылок
+_FILLER_WORDS = _stems("книга книгу книги купить автор автора ozon ru")
+
+
+class LinkPrefetcher:
+    """
+    Спекулятивный поиск ссылок на покупку книг, найденных универсальным поиском.
+
+    После get_books_universal_search модель почти всегда вызывает
+    get_link_on_book для той же книги, но только после еще одного ответа
+    GigaChat. Поэтому для первых ``top`` книг поиск ссылок запускается в фоне
+    сразу, а результат попадает в кэш DuckDuckGo. Когда модель просит ссылки,
+    ``match`` по словам запроса находит предсказанную книгу, и инструмент
+    получает готовый ответ (или присоединяется к запросу в полете).
+
+    Спекулятивные запросы берут только свободные токены DuckDuckGo и не
+    уходят в search_google. Предсказание живет ``ttl`` секунд; если за это
+    время его не использовали и запрос еще не начат, он отменяется.
+
+    Args:
+        top: Для скольких первых книг искать ссылки (0 - выключено).
+        ttl: Сколько секунд ждать вызова get_link_on_book.
+        max_workers: Потоков для фоновых запросов.
+        maxsize: Сколько предсказаний держать одновременно.
+    """
+
+    def __init__(self, top: int = LINK_PREFETCH_TOP, ttl: float = LINK_PREFETCH_TTL,
+                 max_workers: int = 2, maxsize: int = 256):
+        self.top = top
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stats = {"scheduled": 0, "hits": 0, "joined": 0, "misses": 0, "cancelled": 0}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="link-prefetch")
+        # Название книги -> (основы названия, основы авторов, Future, срок годности)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop(self, title: str) -> None:
+        _, _, future, _ = self._entries.pop(title)
+        if future.cancel():
+            self.stats["cancelled"] += 1
+
+    def _expire(self, now: float) -> None:
+        for title in [title for title, entry in self._entries.items() if entry[3] <= now]:
+            self._drop(title)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def schedule(self, books: list) -> None:
+        """Запускает фоновый поиск ссылок для первых ``top`` книг из результата get_books_info."""
+        if not self.top:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for book in books[:self.top]:
+                title = (book.get("title") or "").strip()
+                if not title or title == "Название не указано":
+                    continue
+                entry = self._entries.pop(title, None)
+                if entry is None:
+                    future = self._pool.submit(duckduckgo_search, query=title, site=LINK_PREFETCH_SITE,
+                                               status=True, speculative=True)
+                    entry = (_stems(title), _stems(" ".join(book.get("authors") or [])), future, 0)
+                    self.stats["scheduled"] += 1
+                self._entries[title] = entry[:3] + (now + self.ttl,)
+            self._expire(now)
+
+    def match(self, query: str) -> str | None:
+        """
+        Находит предсказанную книгу для запроса ссылок: все слова названия есть
+        в запросе, а остальные слова запроса - имена авторов.
+
+        Returns:
+            str | None: Название книги, по которому искать ссылки, или None.
+        """
+        words = _stems(query) - _FILLER_WORDS
+        with self._lock:
+            self._expire(time.monotonic())
+            best = None
+            for title, (title_words, author_words, future, _) in self._entries.items():
+                if title_words <= words and words <= title_words | author_words | _FILLER_WORDS:
+                    if best is None or len(title_words) > len(self._entries[best][0]):
+                        best = title
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+            future = self._entries[best][2]
+        if future.done():
+            self.stats["hits"] += 1
+        elif future.cancel():
+            # Запрос не успел начаться: инструмент выполнит его сам, без очереди предсказаний
+            self.stats["cancelled"] += 1
+        else:
+            # Запрос идет: инструмент присоединится к нему через общий in-flight в ddg_search
+            self.stats["joined"] += 1
+        return best
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for title in list(self._entries):
+                self._drop(title)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+link_prefetcher = LinkPrefetcher()
 
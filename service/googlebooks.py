@@ -1,8 +1,141 @@
-import requests # type: ignore
-import json
-from googlesearch import search # type: ignore
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import warnings
+import aiohttp # type: ignore
+import requests # type: ignore
+from settings import settings
+from service.cache import SQLiteBackend, TTLCache, make_key
+from service.http_client import async_http_client, http_client
+
+logger = logging.getLogger(__name__)
+
+
+# Кэш ответов Google Books API, общий для поиска по жанру и универсального поиска
+books_cache = TTLCache(
+    maxsize=settings.get_int("GOOGLE_BOOKS_CACHE_SIZE", 1024),
+    ttl=settings.get_float("GOOGLE_BOOKS_CACHE_TTL", 24 * 3600),
+    negative_ttl=settings.get_float("GOOGLE_BOOKS_CACHE_NEGATIVE_TTL", 600),
+    stale_ttl=settings.get_float("GOOGLE_BOOKS_CACHE_STALE_TTL", 3600),
+    backend=SQLiteBackend(settings.get("GOOGLE_BOOKS_CACHE_DB")) if "GOOGLE_BOOKS_CACHE_DB" in settings else None,
+)
+
+# Partial response: только поля, которые разбирают парсеры ниже
+VOLUME_FIELDS = (
+    "totalItems,items(id,volumeInfo(title,authors,publishedDate,categories,publisher,"
+    "description,infoLink,industryIdentifiers),saleInfo/buyLink)"
+)
+PAGE_SIZE = 10
+GENRE_PAGES = settings.get_int("GOOGLE_BOOKS_GENRE_PAGES", 2)
+PREFETCH_INTERVAL = settings.get_float("GOOGLE_BOOKS_PREFETCH_INTERVAL", 3600)
+PREFETCH_DELAY = settings.get_float("GOOGLE_BOOKS_PREFETCH_DELAY", 300)
+PREFETCH_TOP = settings.get_int("GOOGLE_BOOKS_PREFETCH_TOP", 20)
+PREFETCH_GENRES = [
+    genre.strip()
+    for genre in (settings.get("GOOGLE_BOOKS_PREFETCH_GENRES") or
+                  "fiction,fantasy,science fiction,detective,romance,history,biography,"
+                  "business,psychology,programming").split(",")
+    if genre.strip()
+]
+
+
+def _isbn(volume_info: dict) -> str:
+    """ISBN-13 (или ISBN-10) книги: по нему база книг склеивает записи из разных источников."""
+    identifiers = {item.get('type'): item.get('identifier') for item in volume_info.get('industryIdentifiers', [])}
+    return identifiers.get('ISBN_13') or identifiers.get('ISBN_10') or ''
+
+
+# Пул для параллельных запросов страниц и пакетов запросов
+_batch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="googlebooks")
+
+
+def _fetch_volumes(url: str, params: dict) -> dict:
+    """
+    Запрос к Google Books API через кэш. Ответы с ошибкой API не кэшируются.
+
+    Сетевые ошибки, открытый circuit breaker и не-JSON ответ возвращаются так же,
+    как ошибка API: ``{"error": {"message": ...}}``.
+    """
+    def fetch():
+        try:
+            return http_client.get(url, params=params).json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning("Google Books request failed: %s", e)
+            return {'error': {'message': str(e)}}
+
+    return books_cache.get_or_fetch(
+        make_key(params['q'], **{k: v for k, v in params.items() if k != 'q'}),
+        fetch,
+        is_negative=lambda data: not data.get('items'),
+        should_cache=lambda data: 'error' not in data,
+    )
+
+
+async def _afetch_volumes(url: str, params: dict) -> dict:
+    """Асинхронный вариант _fetch_volumes на общем aiohttp-клиенте и том же кэше."""
+    async def fetch():
+        try:
+            return await async_http_client.get_json(url, params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError, requests.exceptions.RequestException, ValueError) as e:
+            logger.warning("Google Books request failed: %s", e)
+            return {'error': {'message': str(e)}}
+
+    return await books_cache.aget_or_fetch(
+        make_key(params['q'], **{k: v for k, v in params.items() if k != 'q'}),
+        fetch,
+        is_negative=lambda data: not data.get('items'),
+        should_cache=lambda data: 'error' not in data,
+    )
+
+def _merge_pages(pages: list) -> dict:
+    """Склеивает страницы выдачи в один ответ, убирая повторы книг; ошибка первой страницы возвращается как есть."""
+    if not pages or 'error' in pages[0]:
+        return pages[0] if pages else {}
+    items, seen = [], set()
+    for page in pages:
+        for item in page.get('items') or []:
+            if item.get('id') not in seen:
+                seen.add(item.get('id'))
+                items.append(item)
+    return {'totalItems': pages[0].get('totalItems', 0), 'items': items}
+
+
+def fetch_volumes_batch(url: str, params_list: list) -> list:
+    """Выполняет несколько запросов к Google Books параллельно (через кэш); порядок ответов совпадает с params_list."""
+    return list(_batch_pool.map(lambda params: _fetch_volumes(url, params), params_list))
+
+
+async def afetch_volumes_batch(url: str, params_list: list) -> list:
+    """Асинхронный вариант fetch_volumes_batch."""
+    return await asyncio.gather(*(_afetch_volumes(url, params) for params in params_list))
+
+
+class QueryPopularity:
+    """Счетчик запросов к Google Books, по которому BooksPrefetcher выбирает, что прогревать."""
+
+    def __init__(self, maxsize: int = 5000):
+        self.maxsize = maxsize
+        self._counts: dict = {"genre": Counter(), "query": Counter()}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, query: str) -> None:
+        query = " ".join(query.lower().split())
+        with self._lock:
+            counts = self._counts[kind]
+            counts[query] += 1
+            if len(counts) > self.maxsize:
+                self._counts[kind] = Counter(dict(counts.most_common(self.maxsize // 2)))
+
+    def top(self, kind: str, n: int) -> list:
+        with self._lock:
+            return [query for query, _ in self._counts[kind].most_common(n)]
+
+
+popularity = QueryPopularity()
+
 
 def search_google(query: str, site: str = "wildberries.ru", status: bool = None) -> List[str]:
     """
@@ -22,29 +155,45 @@ def search_google(query: str, site: str = "wildberries.ru", status: bool = None)
         full_query = f"{query} site:{site}" if site else query
 
     
+    # googlesearch нужен только как запасной поиск, поэтому импортируется при первом вызове
+    from googlesearch import search # type: ignore
+
     # Подавляем предупреждения о возможных блокировках Google
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         try:
             return list(search(full_query, num_results=5))
         except Exception as e:
-            print(f"Ошибка поиска: {e}")
+            logger.warning("Ошибка поиска: %s", e)
             return []
 
 class GoogleBooksUniversalSearch:
     def __init__(self):
         self.base_url = "https://www.googleapis.com/books/v1/volumes"
     
-    def search_books(self, query: str):
-        """Выполняет поиск книг по запросу"""
-        params = {
+    def _params(self, query: str, page: int = 0) -> dict:
+        return {
             'q': query,
-            'maxResults': 10,
-            'printType': 'books'
+            'maxResults': PAGE_SIZE,
+            'startIndex': page * PAGE_SIZE,
+            'printType': 'books',
+            'fields': VOLUME_FIELDS,
         }
-        response = requests.get(self.base_url, params=params)
-        return response.json()
-    
+
+    def search_books(self, query: str):
+        """Выполняет поиск книг по запросу"""
+        return _fetch_volumes(self.base_url, self._params(query))
+
+    async def asearch_books(self, query: str):
+        """Асинхронный вариант search_books"""
+        return await _afetch_volumes(self.base_url, self._params(query))
+
+    def search_many(self, queries: list, pages: int = 1) -> list:
+        """Выполняет несколько запросов (и по pages страниц каждого) параллельно"""
+        params_list = [self._params(query, page) for query in queries for page in range(pages)]
+        responses = fetch_volumes_batch(self.base_url, params_list)
+        return [_merge_pages(responses[i:i + pages]) for i in range(0, len(responses), pages)]
+
     def parse_book_data(self, raw_data: dict) -> list:
         """Парсит сырые данные и возвращает структурированную информацию"""
         parsed_books = []
@@ -68,7 +217,8 @@ class GoogleBooksUniversalSearch:
                 'categories': volume_info.get('categories', ['Жанр не указан']),
                 'publisher': volume_info.get('publisher', 'Издатель не указан'),
                 'description': volume_info.get('description', 'Описание отсутствует'),
-                'BuyLink': sale_info.get('buyLink', 'Недоступно для покупки')
+                'BuyLink': sale_info.get('buyLink', 'Недоступно для покупки'),
+                'isbn': _isbn(volume_info),
             }
             parsed_books.append(parsed_book)
         
@@ -76,6 +226,7 @@ class GoogleBooksUniversalSearch:
     
     def get_books_info(self, query: str) -> dict:
         """Основной метод для получения информации о книгах"""
+        popularity.record("query", query)
         raw_data = self.search_books(query)
         parsed_data = self.parse_book_data(raw_data)
         
@@ -85,22 +236,52 @@ class GoogleBooksUniversalSearch:
             'books': parsed_data
         }
 
+    async def aget_books_info(self, query: str) -> dict:
+        """Асинхронный вариант get_books_info"""
+        popularity.record("query", query)
+        parsed_data = self.parse_book_data(await self.asearch_books(query))
+        return {
+            'query': query,
+            'count': len(parsed_data),
+            'books': parsed_data
+        }
+
 class GoogleBooksSearcherByGenre:
     def __init__(self):
         self.base_url = "https://www.googleapis.com/books/v1/volumes"
     
-    def search_by_genre(self, genre_query: str):
+    def _params(self, genre_query: str, page: int = 0) -> dict:
+        return {
+            'q': f'subject:{genre_query}',
+            'maxResults': PAGE_SIZE,
+            'startIndex': page * PAGE_SIZE,
+            'printType': 'books',
+            'fields': VOLUME_FIELDS,
+        }
+
+    def search_by_genre(self, genre_query: str, pages: int = GENRE_PAGES):
         """
         Выполняет поиск книг по указанному жанру с использованием Google Books API.
+        Страницы выдачи запрашиваются параллельно и склеиваются.
         Возвращает JSON-данные о найденных книгах.
         """
-        params = {
-            'q': f'subject:{genre_query}',
-            'maxResults': 10,
-            'printType': 'books'
-        }
-        response = requests.get(self.base_url, params=params)
-        return response.json()
+        return self.search_by_genres([genre_query], pages)[0]
+
+    async def asearch_by_genre(self, genre_query: str, pages: int = GENRE_PAGES):
+        """Асинхронный вариант search_by_genre"""
+        return (await self.asearch_by_genres([genre_query], pages))[0]
+
+    def search_by_genres(self, genres: list, pages: int = GENRE_PAGES) -> list:
+        """Ищет книги сразу по нескольким жанрам, все запросы и страницы идут параллельно"""
+        params_list = [self._params(genre, page) for genre in genres for page in range(pages)]
+        responses = fetch_volumes_batch(self.base_url, params_list)
+        return [_merge_pages(responses[i:i + pages]) for i in range(0, len(responses), pages)]
+
+    async def asearch_by_genres(self, genres: list, pages: int = GENRE_PAGES) -> list:
+        """Асинхронный вариант search_by_genres"""
+        params_list = [self._params(genre, page) for genre in genres for page in range(pages)]
+        responses = await afetch_volumes_batch(self.base_url, params_list)
+        return [_merge_pages(responses[i:i + pages]) for i in range(0, len(responses), pages)]
     
     def _clean_published_date(self, date_str):
         """Очищает строку с датой публикации, оставляя только год."""
@@ -130,6 +311,7 @@ class GoogleBooksSearcherByGenre:
                 "publisher": volume_info.get('publisher', 'Издатель не указан'),
                 "description": volume_info.get('description', 'Описание отсутствует'),
                 "BuyLink": volume_info.get('infoLink', ''),
+                "isbn": _isbn(volume_info),
             }
             
             parsed_books.append(book_data)
@@ -139,11 +321,73 @@ class GoogleBooksSearcherByGenre:
             "books": parsed_books
         }
     
-    def parse_and_return(self, genre_query: str):
-        """
-        Полностью обрабатывает запрос — ищет книги по жанру и парсит данные.
-        Возвращает готовый JSON с результатами.
-        """
-        books_data = self.search_by_genre(genre_query)
-        parsed_data = self.parse_book_data(books_data)
-        return json.dumps(parsed_data, indent=2, ensure_ascii=False)
+    def get_books_info(self, genre_query: str) -> dict:
+        """Ищет книги по жанру и возвращает разобранный результат"""
+        popularity.record("genre", genre_query)
+        return self.parse_book_data(self.search_by_genre(genre_query))
+
+    async def aget_books_info(self, genre_query: str) -> dict:
+        """Асинхронный вариант get_books_info"""
+        popularity.record("genre", genre_query)
+        return self.parse_book_data(await self.asearch_by_genre(genre_query))
+
+
+class BooksPrefetcher:
+    """
+    Фоновый прогрев кэша Google Books.
+
+    Раз в ``interval`` секунд пакетно запрашивает популярные жанры (список
+    из настроек плюс самые частые жанры пользователей) и самые частые
+    поисковые запросы. Свежие записи берутся из кэша без запросов к API,
+    устаревшие обновляются, поэтому популярные запросы почти всегда
+    отвечаются из кэша. Первый прогон откладывается на ``delay`` секунд,
+    чтобы не занимать квоту API во время запуска и успеть накопить
+    статистику запросов.
+
+    Args:
+        genres: Жанры, которые прогреваются всегда.
+        top: Сколько самых частых жанров и запросов прогревать дополнительно.
+        interval: Период прогрева в секундах.
+        delay: Задержка первого прогона в секундах.
+    """
+
+    def __init__(self, genres: list = PREFETCH_GENRES, top: int = PREFETCH_TOP, interval: float = PREFETCH_INTERVAL,
+                 delay: float = PREFETCH_DELAY):
+        self.genres = genres
+        self.top = top
+        self.interval = interval
+        self.delay = delay
+        self.stats = {"runs": 0, "queries": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> None:
+        genres = list(dict.fromkeys(self.genres + popularity.top("genre", self.top)))
+        queries = popularity.top("query", self.top)
+        GoogleBooksSearcherByGenre().search_by_genres(genres)
+        GoogleBooksUniversalSearch().search_many(queries)
+        self.stats["runs"] += 1
+        self.stats["queries"] += len(genres) + len(queries)
+
+    def _loop(self) -> None:
+        self._stop.wait(self.delay)
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("Google Books prefetch failed: %s", e)
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="googlebooks-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+
+prefetcher = BooksPrefetcher()
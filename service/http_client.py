@@ -0,0 +1,287 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import aiohttp # type: ignore
+import requests # type: ignore
+from requests.adapters import HTTPAdapter # type: ignore
+from settings import settings
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Хост временно исключен из запросов после серии ошибок."""
+
+
+class CircuitBreaker:
+    """
+    Автомат "closed -> open -> half-open" для одного хоста.
+
+    После ``failure_threshold`` ошибок подряд запросы к хосту сразу падают с
+    CircuitOpenError в течение ``reset_timeout`` секунд. Затем пропускается
+    один пробный запрос: успех закрывает автомат, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов "token bucket".
+
+    Токены пополняются со скоростью ``rate`` в секунду, копится не больше
+    ``capacity``, поэтому короткий всплеск до ``capacity`` запросов проходит
+    сразу, а дальше запросы выравниваются до ``rate`` в секунду.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Ждет токен не дольше timeout секунд; False, если дождаться не успели."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _RetryPolicy:
+    """Общие для sync и async клиентов таймауты, политика повторов и circuit breaker по хостам."""
+
+    def __init__(
+        self,
+        connect_timeout: float = settings.get_float("HTTP_CONNECT_TIMEOUT", 3.05),
+        read_timeout: float = settings.get_float("HTTP_READ_TIMEOUT", 10),
+        retries: int = settings.get_int("HTTP_RETRIES", 2),
+        backoff: float = 0.5,
+        max_backoff: float = 8,
+        pool_maxsize: int = settings.get_int("HTTP_POOL_MAXSIZE", 10),
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_maxsize = pool_maxsize
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self._breakers: dict = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[host]
+
+    def open_circuits(self) -> int:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return sum(breaker.state != "closed" for breaker in breakers)
+
+    def _check_breaker(self, url: str) -> CircuitBreaker:
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+        return breaker
+
+    def _delay(self, attempt: int, headers=None) -> float:
+        retry_after = headers.get("Retry-After") if headers is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        # Full jitter: случайная задержка от 0 до экспоненциальной границы
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class HttpClient(_RetryPolicy):
+    """
+    Общий HTTP-клиент для всех сервисов.
+
+    Держит keep-alive соединения в пуле requests.Session (не больше
+    ``pool_maxsize`` на хост), всегда выставляет таймауты на соединение и
+    чтение, повторяет запросы при 429/5xx и сетевых ошибках с
+    экспоненциальной задержкой и джиттером (учитывая Retry-After) и
+    отключает хост через CircuitBreaker, если тот стабильно не отвечает.
+
+    Args:
+        connect_timeout: Таймаут установки соединения в секундах.
+        read_timeout: Таймаут чтения ответа в секундах.
+        retries: Количество повторов после первой попытки.
+        backoff: Базовая задержка перед повтором в секундах.
+        max_backoff: Верхняя граница задержки в секундах.
+        pool_maxsize: Максимум соединений к одному хосту.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.pool_maxsize, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Выполняет запрос с таймаутами, повторами и circuit breaker."""
+        kwargs.setdefault("timeout", self.timeout)
+        breaker = self._check_breaker(url)
+        try:
+            for attempt in range(self.retries + 1):
+                self.stats["requests"] += 1
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt == self.retries:
+                        raise
+                    self.stats["retries"] += 1
+                    time.sleep(self._delay(attempt))
+                    continue
+                if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                    self.stats["retries"] += 1
+                    time.sleep(self._delay(attempt, response.headers))
+                    continue
+                if response.status_code in RETRY_STATUSES:
+                    self.stats["failures"] += 1
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                return response
+        except BaseException:
+            # Любое исключение (и InvalidURL, ChunkedEncodingError) считается ошибкой хоста,
+            # иначе пробный запрос в half-open не завершится и хост останется закрыт навсегда
+            self.stats["failures"] += 1
+            breaker.record_failure()
+            raise
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+
+class AsyncHttpClient(_RetryPolicy):
+    """
+    Асинхронный вариант HttpClient на aiohttp для async-инструментов агентов.
+
+    Сессия создается лениво в работающем event loop. Лимит соединений на хост,
+    таймауты, повторы и circuit breaker такие же, как у синхронного клиента.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.pool_maxsize),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+        return self._session
+
+    async def get_json(self, url: str, params: dict | None = None, headers: dict | None = None):
+        """GET с повторами; возвращает разобранный JSON-ответ."""
+        breaker = self._check_breaker(url)
+        try:
+            session = self._get_session()
+            for attempt in range(self.retries + 1):
+                self.stats["requests"] += 1
+                try:
+                    async with session.get(url, params=params, headers=headers) as response:
+                        if response.status in RETRY_STATUSES and attempt < self.retries:
+                            self.stats["retries"] += 1
+                            delay = self._delay(attempt, response.headers)
+                        else:
+                            data = await response.json(content_type=None)
+                            if response.status in RETRY_STATUSES:
+                                self.stats["failures"] += 1
+                                breaker.record_failure()
+                            else:
+                                breaker.record_success()
+                            return data
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt == self.retries:
+                        raise
+                    self.stats["retries"] += 1
+                    delay = self._delay(attempt)
+                await asyncio.sleep(delay)
+        except BaseException:
+            # То же для ContentTypeError, ошибки разбора JSON и отмены задачи
+            self.stats["failures"] += 1
+            breaker.record_failure()
+            raise
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+http_client = HttpClient()
+async_http_client = AsyncHttpClient()
@@ -0,0 +1,356 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from settings import settings
+# Заглушки парсеров Google Books не сохраняем
+from llm.result_shaping import PLACEHOLDERS
+from service.sberbank_catalog import catalog as default_catalog
+
+logger = logging.getLogger(__name__)
+
+
+KB_ENABLED = settings.get_bool("BOOK_KB_ENABLED", True)
+KB_PATH = settings.get("BOOK_KB_DB", "data/book_kb.sqlite3")
+# Политика свежести: старше этого книги и ссылки не отдаются, а запрашиваются заново
+KB_MAX_AGE = settings.get_float("BOOK_KB_MAX_AGE", 7 * 24 * 3600)
+KB_LINKS_MAX_AGE = settings.get_float("BOOK_KB_LINKS_MAX_AGE", 24 * 3600)
+# Сколько книг должно найтись локально, чтобы не ходить в Google Books
+KB_MIN_RESULTS = settings.get_int("BOOK_KB_MIN_RESULTS", 3)
+# Сколько книг записывается за одно взятие блокировки: между пачками проходят поиски
+KB_BATCH_SIZE = settings.get_int("BOOK_KB_BATCH_SIZE", 500)
+
+# Слова запроса, которые не встречаются в названиях и именах авторов
+STOP_WORDS = {"книга", "книги", "книгу", "книг", "автор", "автора", "про", "об", "the", "and", "of"}
+DATA_FIELDS = ("publishedDate", "categories", "publisher", "description", "BuyLink", "thumbnail")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    isbn TEXT,
+    title_key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    data TEXT NOT NULL,
+    links TEXT,
+    links_at REAL,
+    sber_id INTEGER,
+    sber_link TEXT,
+    is_reserved INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+CREATE INDEX IF NOT EXISTS books_title_key ON books (title_key);
+CREATE UNIQUE INDEX IF NOT EXISTS books_sber_id ON books (sber_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, authors, categories, description, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def _words(text) -> list:
+    return re.findall(r"\w+", str(text or "").lower().replace("ё", "е"))
+
+
+def title_key(title: str, authors: list) -> str:
+    """
+    Ключ дедупликации без ISBN: нормализованное название и фамилия первого автора.
+
+    Фамилией считается самое длинное слово имени, поэтому "Стругацкий А." и
+    "Аркадий Стругацкий" дают один ключ.
+    """
+    author = max(_words(authors[0]), key=len, default="") if authors else ""
+    return " ".join(_words(title)) + "|" + author
+
+
+def _fts_query(text: str, operator: str = "AND") -> str | None:
+    # Ищем по названию и авторам; длинные слова ищутся по началу, чтобы ловить формы слова
+    terms = [word for word in _words(text) if word not in STOP_WORDS and (len(word) > 1 or word.isdigit())]
+    if not terms:
+        return None
+    return "{title authors}: (" + f" {operator} ".join(
+        f'"{word[:5]}"*' if len(word) > 5 else f'"{word}"' for word in terms
+    ) + ")"
+
+
+def _sber_signature(book: dict) -> tuple:
+    # Поля книги Сбербанка, которые попадают в базу: если они не менялись, книгу не перезаписываем
+    return (book["name"], book["author"], book["category"], book["description"], book["link"], book["isReserved"])
+
+
+def _clean(value):
+    if isinstance(value, list):
+        value = [item for item in value if item and item not in PLACEHOLDERS]
+        return value or None
+    return None if not value or value in PLACEHOLDERS else value
+
+
+class BookKnowledgeBase:
+    """
+    Локальная база книг из всех источников с полнотекстовым поиском (SQLite FTS5).
+
+    В базу попадают книги из Google Books (универсальный поиск и поиск по
+    жанру), ссылки на покупку из DuckDuckGo и каталог библиотеки Сбербанка.
+    Одна книга из разных источников хранится одной записью: совпадение ищется
+    по ISBN, затем по нормализованным названию и фамилии автора. К записи
+    привязаны ссылки на покупку и доступность в библиотеке Сбербанка.
+
+    Инструменты агента сначала ищут здесь и идут во внешние API, только если
+    локальных результатов мало или они старше ``max_age`` (для ссылок -
+    ``links_max_age``). База лежит в файле и переживает перезапуск бота.
+
+    Каталог Сбербанка переносится в базу после ``start()``: его вызывает
+    только один процесс, остальные воркеры пишут в тот же файл лишь
+    результаты своих запросов.
+
+    Args:
+        path: Путь к файлу SQLite (":memory:" - только в памяти).
+        catalog: Каталог Сбербанка, изменения которого переносятся в базу.
+        max_age: Сколько секунд книга считается свежей.
+        links_max_age: Сколько секунд считаются свежими ссылки на покупку.
+        min_results: Сколько книг должно найтись локально, чтобы не обращаться к Google Books.
+        enabled: False - база не используется, инструменты всегда идут во внешние API.
+    """
+
+    def __init__(self, path: str = KB_PATH, catalog=default_catalog, max_age: float = KB_MAX_AGE,
+                 links_max_age: float = KB_LINKS_MAX_AGE, min_results: int = KB_MIN_RESULTS,
+                 enabled: bool = KB_ENABLED):
+        self.path = path
+        self.max_age = max_age
+        self.links_max_age = links_max_age
+        self.min_results = min_results
+        self.enabled = enabled
+        self.stats = {"local_hits": 0, "local_misses": 0, "link_hits": 0, "link_misses": 0,
+                      "ingested": 0, "merged": 0, "errors": 0}
+        self.catalog = catalog
+        self.rows = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._started = False
+        # id книги Сбербанка -> _sber_signature уже записанной версии
+        self._sber_seen: dict = {}
+
+    def start(self) -> None:
+        """Подписывает базу на обновления каталога Сбербанка и статусы книг."""
+        if not self.enabled or self._started:
+            return
+        self._started = True
+        self.catalog.on_update(lambda: self.ingest_sberbank(self.catalog.books))
+        self.catalog.on_status(lambda book: self.set_availability(book["id"], book["isReserved"]))
+
+    def open(self, path: str | None = None) -> None:
+        """Переоткрывает базу, например в другом файле (бенчмарк открывает ":memory:")."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self.path = path or self.path
+            self._sber_seen = {}
+            self._db()
+
+    def _db(self) -> sqlite3.Connection:
+        # Вызывается под self._lock; файл создается при первом обращении, а не при импорте
+        if self._conn is None:
+            if self.path != ":memory:" and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            if self.path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self.rows = self._conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        return self._conn
+
+    def _find(self, db, isbn: str | None, key: str, sber_id=None):
+        if sber_id is not None:
+            row = db.execute("SELECT id, data FROM books WHERE sber_id = ?", (sber_id,)).fetchone()
+            if row:
+                return row
+        if isbn:
+            row = db.execute("SELECT id, data FROM books WHERE isbn = ?", (isbn,)).fetchone()
+            if row:
+                return row
+        # Второй экземпляр той же книги в библиотеке Сбербанка - отдельная запись
+        return db.execute(
+            "SELECT id, data FROM books WHERE title_key = ? AND (? IS NULL OR sber_id IS NULL) LIMIT 1",
+            (key, sber_id),
+        ).fetchone()
+
+    def _upsert(self, db, now: float, title: str, authors: list, data: dict, isbn: str | None = None,
+                sber: dict | None = None) -> None:
+        key = title_key(title, authors)
+        sber_id = sber["id"] if sber else None
+        row = self._find(db, isbn, key, sber_id)
+        if row is None:
+            cursor = db.execute(
+                "INSERT INTO books (isbn, title_key, title, authors, data, sber_id, sber_link, is_reserved, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (isbn, key, title, json.dumps(authors, ensure_ascii=False), json.dumps(data, ensure_ascii=False),
+                 sber_id, sber and sber["link"], sber and int(sber["isReserved"]), now),
+            )
+            book_id = cursor.lastrowid
+            self.rows += 1
+            self.stats["ingested"] += 1
+        else:
+            book_id = row[0]
+            # Новые непустые поля дополняют и обновляют старые
+            data = {**json.loads(row[1]), **data}
+            db.execute(
+                "UPDATE books SET isbn = COALESCE(isbn, ?), data = ?, updated_at = ? WHERE id = ?",
+                (isbn, json.dumps(data, ensure_ascii=False), now, book_id),
+            )
+            if sber:
+                db.execute(
+                    "UPDATE books SET sber_id = ?, sber_link = ?, is_reserved = ? WHERE id = ?",
+                    (sber_id, sber["link"], int(sber["isReserved"]), book_id),
+                )
+            self.stats["merged"] += 1
+        db.execute("DELETE FROM books_fts WHERE rowid = ?", (book_id,))
+        db.execute(
+            "INSERT INTO books_fts (rowid, title, authors, categories, description) "
+            "SELECT id, title, ?, ?, ? FROM books WHERE id = ?",
+            (" ".join(authors), " ".join(data.get("categories") or []), data.get("description") or "", book_id),
+        )
+
+    def _write(self, rows: list, upsert, batch_size: int = KB_BATCH_SIZE) -> bool:
+        """Записывает rows пачками по batch_size, отпуская блокировку между пачками; False при ошибке SQLite."""
+        if not self.enabled or not rows:
+            return True
+        now = time.time()
+        try:
+            for start in range(0, len(rows), batch_size):
+                with self._lock:
+                    db = self._db()
+                    with db:
+                        for row in rows[start:start + batch_size]:
+                            upsert(db, now, row)
+            return True
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.warning("Book knowledge base write failed: %s", e)
+            return False
+
+    def ingest_google(self, books: list) -> None:
+        """Сохраняет книги, разобранные парсерами Google Books."""
+        def upsert(db, now, book):
+            title = _clean(book.get("title"))
+            if not title:
+                return
+            data = {field: value for field in DATA_FIELDS if (value := _clean(book.get(field))) is not None}
+            self._upsert(db, now, title, _clean(book.get("authors")) or [], data, isbn=book.get("isbn") or None)
+
+        self._write(books, upsert)
+
+    def ingest_sberbank(self, books: list) -> None:
+        """
+        Сохраняет каталог библиотеки Сбербанка вместе с доступностью книг.
+
+        Перезаписываются только новые и изменившиеся с прошлого вызова книги,
+        у остальных лишь продлевается свежесть.
+        """
+        def upsert(db, now, book):
+            data = {"categories": [book["category"]], "description": _clean(book["description"])}
+            self._upsert(db, now, book["name"], [book["author"]], {k: v for k, v in data.items() if v}, sber=book)
+
+        def touch(db, now, book):
+            db.execute("UPDATE books SET updated_at = ? WHERE sber_id = ?", (now, book["id"]))
+
+        seen = {book["id"]: _sber_signature(book) for book in books}
+        changed = {i for i, signature in seen.items() if self._sber_seen.get(i) != signature}
+        if self._write([book for book in books if book["id"] in changed], upsert):
+            self._sber_seen = seen
+        self._write([book for book in books if book["id"] not in changed], touch)
+
+    def set_availability(self, sber_id, is_reserved: bool) -> None:
+        self._write([None], lambda db, now, _: db.execute(
+            "UPDATE books SET is_reserved = ? WHERE sber_id = ?", (int(is_reserved), sber_id)
+        ))
+
+    def _to_book(self, row, with_links: bool) -> dict:
+        _, isbn, title, authors, data, links, links_at, sber_id, sber_link, is_reserved = row
+        book = {"title": title, "authors": json.loads(authors), **json.loads(data)}
+        if isbn:
+            book["isbn"] = isbn
+        if with_links and links and links_at and time.time() - links_at <= self.links_max_age:
+            book["links"] = [link["href"] for link in json.loads(links)[:3]]
+        if sber_id is not None:
+            book["sberbank"] = {"isReserved": bool(is_reserved), "link": sber_link}
+        return book
+
+    def _select(self, query: str, limit: int, max_age: float, operator: str = "AND") -> list:
+        match = _fts_query(query, operator)
+        if not self.enabled or match is None:
+            return []
+        try:
+            with self._lock:
+                return self._db().execute(
+                    "SELECT b.id, b.isbn, b.title, b.authors, b.data, b.links, b.links_at, b.sber_id, b.sber_link, "
+                    "b.is_reserved FROM books_fts JOIN books b ON b.id = books_fts.rowid "
+                    "WHERE books_fts MATCH ? AND b.updated_at >= ? ORDER BY bm25(books_fts, 10.0, 5.0) LIMIT ?",
+                    (match, time.time() - max_age, limit),
+                ).fetchall()
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.warning("Book knowledge base search failed: %s", e)
+            return []
+
+    def search(self, query: str, limit: int = 10) -> list | None:
+        """
+        Ищет свежие книги, в названии или авторах которых есть все слова запроса.
+
+        Returns:
+            list | None: Книги или None, если нашлось меньше ``min_results`` и нужно идти в Google Books.
+        """
+        rows = self._select(query, limit, self.max_age)
+        if len(rows) < max(self.min_results, 1):
+            self.stats["local_misses"] += 1
+            return None
+        self.stats["local_hits"] += 1
+        return [self._to_book(row, with_links=True) for row in rows]
+
+    def lookup(self, query: str, limit: int = 5) -> list:
+        """Книги (любой свежести), в названии или авторах которых есть все слова запроса: только title и authors."""
+        return [{"title": row[2], "authors": json.loads(row[3])} for row in self._select(query, limit, float("inf"))]
+
+    def _resolve(self, query: str):
+        """Книга, к которой относится запрос ссылок: все слова ее названия есть в запросе."""
+        words = set(_words(query))
+        # В запросе ссылок кроме названия бывают "купить", автор и т.п., поэтому ищем по любому слову
+        for row in self._select(query, 20, float("inf"), operator="OR"):
+            if set(_words(row[2])) <= words:
+                return row
+        return None
+
+    def links(self, query: str) -> list | None:
+        """Свежие ссылки на покупку книги из запроса или None, если их нужно искать заново."""
+        row = self._resolve(query)
+        if row is None or not row[5] or time.time() - (row[6] or 0) > self.links_max_age:
+            self.stats["link_misses"] += 1
+            return None
+        self.stats["link_hits"] += 1
+        return json.loads(row[5])
+
+    def attach_links(self, query: str, results) -> None:
+        """Привязывает найденные ссылки на покупку к книге из запроса, если она есть в базе."""
+        if not isinstance(results, list) or not results:
+            return
+        row = self._resolve(query)
+        if row is None:
+            return
+        links = [{"title": item.get("title", ""), "href": item.get("href", "")} for item in results]
+        self._write([None], lambda db, now, _: db.execute(
+            "UPDATE books SET links = ?, links_at = ? WHERE id = ?",
+            (json.dumps(links, ensure_ascii=False), now, row[0]),
+        ))
+
+    def count(self) -> int:
+        # Без блокировки: /metrics читает счетчик из event loop, пока идет запись каталога
+        return self.rows if self.enabled else 0
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, books=self.count())
+
+
+knowledge_base = BookKnowledgeBase()
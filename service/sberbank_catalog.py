@@ -0,0 +1,341 @@
+import logging
+import threading
+import time
+from collections import deque
+import requests # type: ignore
+from settings import settings
+from service.cache import TTLCache
+from service.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+
+BOOKS_URL = "https://api.book.benifits.ru/custom/api/v1/books/"
+CATEGORIES_URL = "https://api.book.benifits.ru/custom/api/v1/category/all"
+BOOK_LINK = "https://api.book.benifits.ru/custom/api/v1/books/{id}"
+
+CATALOG_TTL = settings.get_float("SBER_CATALOG_TTL", 900)
+CATALOG_REFRESH_INTERVAL = settings.get_float("SBER_CATALOG_REFRESH_INTERVAL", 300)
+# Статус отдельной книги с /books/{id} кэшируется ненадолго: он меняется чаще каталога
+BOOK_STATUS_TTL = settings.get_float("SBER_BOOK_STATUS_TTL", 60)
+CHANGE_LOG_SIZE = settings.get_int("SBER_CHANGE_LOG_SIZE", 5000)
+
+REQUIRED_KEYS = ['id', 'isReserved', 'name', 'author', 'category', 'description']
+# Поля, при изменении которых нужно перестраивать индексы; isReserved обновляется на месте
+CONTENT_KEYS = ("name", "author", "category", "description")
+
+
+def _normalize(text) -> str:
+    return " ".join(str(text or "").lower().replace("ё", "е").split())
+
+
+def _parse_book(book: dict) -> dict:
+    return {
+        "id": book['id'],
+        "name": book['name'],
+        "author": book['author'],
+        "category": book['category']['name'],
+        "isReserved": book['isReserved'],
+        "link": BOOK_LINK.format(id=book['id']),
+        "description": book['description'],
+    }
+
+
+class SberbankCatalog:
+    """
+    Локальная копия каталога библиотеки Сбербанка.
+
+    Каталог и категории скачиваются в фоне с условными запросами
+    (If-None-Match / If-Modified-Since), поэтому неизменившийся каталог не
+    перекачивается. Книги индексируются по категории, автору и словам
+    названия, а инструменты агента получают только подходящие записи.
+
+    Каждая новая версия каталога сравнивается с предыдущей. Если изменились
+    только статусы резервирования, они обновляются в тех же записях без
+    перестройки индексов (и поискового индекса). Изменения статусов пишутся
+    в журнал, по которому отвечает ``available_since``. Статус одной книги
+    можно уточнить запросом ``/books/{id}`` (``book_status``) без скачивания
+    всего каталога.
+
+    Args:
+        ttl: Через сколько секунд данные считаются устаревшими и обновляются при обращении.
+        refresh_interval: Период фонового обновления в секундах.
+        status_ttl: Сколько секунд кэшировать статус книги с /books/{id}.
+        change_log_size: Сколько последних изменений хранить в журнале.
+    """
+
+    def __init__(self, books_url=BOOKS_URL, categories_url=CATEGORIES_URL,
+                 ttl: float = CATALOG_TTL, refresh_interval: float = CATALOG_REFRESH_INTERVAL,
+                 status_ttl: float = BOOK_STATUS_TTL, change_log_size: int = CHANGE_LOG_SIZE):
+        self.books_url = books_url
+        self.categories_url = categories_url
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.fetched_at = 0.0
+        # Увеличивается при каждой перестройке индексов, по нему поисковый индекс понимает, что каталог изменился
+        self.version = 0
+        self.stats = {"fetches": 0, "not_modified": 0, "errors": 0, "incremental_syncs": 0,
+                      "status_changes": 0, "detail_fetches": 0, "detail_errors": 0}
+        self.status_cache = TTLCache(maxsize=2048, ttl=status_ttl, negative_ttl=status_ttl, stale_ttl=0)
+        # Журнал изменений: {"at", "id", "name", "event"}, event - added/removed/reserved/released
+        self.changes: deque = deque(maxlen=change_log_size)
+        # Когда книга получила текущий статус; для книг из первой загрузки время неизвестно
+        self._status_since: dict = {}
+        self._books: dict = {}
+        self._categories: list = []
+        self._by_category: dict = {}
+        self._by_author: dict = {}
+        self._by_title_word: dict = {}
+        self._validators: dict = {}
+        self._listeners: list = []
+        self._status_listeners: list = []
+        self._lock = threading.Lock()
+        # Отдельный lock для статусов: _lock держится на время скачивания каталога
+        self._status_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _conditional_get(self, url: str):
+        """GET с валидаторами прошлого ответа. Возвращает JSON или None, если данные не изменились."""
+        headers = {}
+        etag, last_modified = self._validators.get(url, (None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = http_client.get(url, headers=headers)
+        if response.status_code == 304:
+            self.stats["not_modified"] += 1
+            return None
+        response.raise_for_status()
+        self.stats["fetches"] += 1
+        self._validators[url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.json()['body']
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.fetched_at <= self.ttl
+
+    def on_update(self, callback) -> None:
+        """Регистрирует callback(), вызываемый после каждой перестройки индексов каталога."""
+        self._listeners.append(callback)
+
+    def on_status(self, callback) -> None:
+        """Регистрирует callback(book), вызываемый при смене статуса книги без перестройки индексов."""
+        self._status_listeners.append(callback)
+
+    def refresh(self, force: bool = True) -> None:
+        """Обновляет каталог и категории, перестраивая индексы только при изменениях."""
+        version = self.version
+        self._refresh(force)
+        if self.version != version:
+            for callback in self._listeners:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warning("Sberbank catalog listener failed: %s", e)
+
+    def _refresh(self, force: bool) -> None:
+        with self._lock:
+            if not force and self.is_fresh():
+                # Пока ждали lock, каталог уже обновил другой поток
+                return
+            try:
+                raw_books = self._conditional_get(self.books_url)
+                raw_categories = self._conditional_get(self.categories_url)
+            except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+                self.stats["errors"] += 1
+                logger.warning("Sberbank catalog refresh failed: %s", e)
+                # Повторяем не раньше чем через 30 секунд, чтобы не долбить упавший API
+                self.fetched_at = max(self.fetched_at, time.time() - self.ttl + 30)
+                return
+            if raw_books is not None:
+                self._sync([
+                    _parse_book(book) for book in raw_books
+                    if all(key in book for key in REQUIRED_KEYS)
+                ])
+            if raw_categories is not None:
+                self._categories = [category['name'] for category in raw_categories]
+            self.fetched_at = time.time()
+
+    def _record(self, book: dict, event: str, at: float) -> None:
+        self.changes.append({"at": at, "id": book["id"], "name": book["name"], "event": event})
+        if event != "removed":
+            self._status_since[book["id"]] = at
+        self.stats["status_changes"] += 1
+
+    def _set_status(self, book: dict, is_reserved: bool, at: float) -> None:
+        """Меняет статус книги на месте (записи общие с поисковым индексом) и пишет изменение в журнал."""
+        with self._status_lock:
+            if book["isReserved"] == is_reserved:
+                return
+            book["isReserved"] = is_reserved
+            self._record(book, "reserved" if is_reserved else "released", at)
+        for callback in self._status_listeners:
+            try:
+                callback(book)
+            except Exception as e:
+                logger.warning("Sberbank catalog status listener failed: %s", e)
+
+    def _sync(self, books: list) -> None:
+        """Применяет новую версию каталога: статусы - на месте, остальные изменения - перестройкой индексов."""
+        now = time.time()
+        old = self._books
+        new = {book["id"]: book for book in books}
+        if old and old.keys() == new.keys() and all(
+            old[i][key] == book[key] for i, book in new.items() for key in CONTENT_KEYS
+        ):
+            for i, book in new.items():
+                self._set_status(old[i], book["isReserved"], now)
+            self.stats["incremental_syncs"] += 1
+            return
+        if old:
+            for i, book in new.items():
+                if i not in old:
+                    self._record(book, "added", now)
+                elif old[i]["isReserved"] != book["isReserved"]:
+                    self._record(book, "reserved" if book["isReserved"] else "released", now)
+            for i in old.keys() - new.keys():
+                self._record(old[i], "removed", now)
+                self._status_since.pop(i, None)
+        self._index(books)
+
+    def _index(self, books: list) -> None:
+        by_id, by_category, by_author, by_title_word = {}, {}, {}, {}
+        for book in books:
+            by_id[book["id"]] = book
+            by_category.setdefault(_normalize(book["category"]), []).append(book["id"])
+            by_author.setdefault(_normalize(book["author"]), []).append(book["id"])
+            for word in set(_normalize(book["name"]).split()):
+                by_title_word.setdefault(word, set()).add(book["id"])
+        # Подменяем индексы целиком, чтобы читатели не видели частичного состояния
+        self._books, self._by_category, self._by_author, self._by_title_word = (
+            by_id, by_category, by_author, by_title_word
+        )
+        self.version += 1
+
+    def ensure_fresh(self) -> None:
+        if not self.is_fresh():
+            self.refresh(force=False)
+
+    @property
+    def books(self) -> list:
+        self.ensure_fresh()
+        return list(self._books.values())
+
+    def categories(self) -> list:
+        self.ensure_fresh()
+        return list(self._categories)
+
+    def get(self, book_id):
+        self.ensure_fresh()
+        return self._books.get(book_id)
+
+    def status_since(self, book_id):
+        """Время (timestamp), с которого у книги текущий статус, или None, если он не менялся при работе бота."""
+        return self._status_since.get(book_id)
+
+    def book_status(self, book_id):
+        """
+        Свежая запись книги с ``/books/{id}``, не дожидаясь обновления каталога.
+
+        Ответ кэшируется на ``status_ttl`` секунд. Если статус отличается от
+        каталога, он обновляется в каталоге и попадает в журнал. При ошибке
+        API возвращается запись из каталога.
+
+        Returns:
+            dict | None: Книга или None, если такой книги нет.
+        """
+        book = self.get(book_id)
+        try:
+            fresh = self.status_cache.get_or_fetch(
+                str(book_id), lambda: self._fetch_book(book_id), is_negative=lambda value: value is None,
+            )
+        except (requests.exceptions.RequestException, KeyError, ValueError, TypeError) as e:
+            self.stats["detail_errors"] += 1
+            logger.warning("Sberbank book %s status fetch failed: %s", book_id, e)
+            return book
+        if fresh is None:
+            return book
+        if book is not None:
+            self._set_status(book, fresh["isReserved"], time.time())
+            return book
+        return fresh
+
+    def _fetch_book(self, book_id):
+        response = http_client.get(BOOK_LINK.format(id=book_id))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        self.stats["detail_fetches"] += 1
+        raw = response.json()['body']
+        return _parse_book(raw) if all(key in raw for key in REQUIRED_KEYS) else None
+
+    def available_since(self, since: float, limit: int = 20) -> list:
+        """
+        Книги, которые стали доступны (освободились или появились) после ``since`` и доступны сейчас.
+
+        Ответ строится по журналу изменений без запросов к API.
+        """
+        self.ensure_fresh()
+        result, seen = [], set()
+        for change in reversed(list(self.changes)):
+            if change["at"] < since:
+                break
+            if change["event"] not in ("released", "added") or change["id"] in seen:
+                continue
+            seen.add(change["id"])
+            book = self._books.get(change["id"])
+            if book is not None and not book["isReserved"]:
+                result.append(book)
+                if len(result) == limit:
+                    break
+        return result
+
+    def search(self, category: str = "", author: str = "", keyword: str = "",
+               available_only: bool = False, limit: int = 20) -> list:
+        """
+        Ищет книги по категории, автору и ключевым словам названия/описания.
+
+        Категория и автор сравниваются по вхождению подстроки без учета регистра,
+        ключевые слова сначала ищутся в индексе слов названия, затем в описании.
+        """
+        self.ensure_fresh()
+        books = self._books
+        candidates = None
+        if category:
+            needle = _normalize(category)
+            candidates = {i for name, ids in self._by_category.items() if needle in name for i in ids}
+        if author:
+            needle = _normalize(author)
+            ids = {i for name, ids in self._by_author.items() if needle in name for i in ids}
+            candidates = ids if candidates is None else candidates & ids
+        words = _normalize(keyword).split()
+        if words:
+            ids = set.intersection(*(self._by_title_word.get(word, set()) for word in words))
+            if not ids:
+                ids = {
+                    i for i, book in books.items()
+                    if all(word in _normalize(book["name"] + " " + book["description"]) for word in words)
+                }
+            candidates = ids if candidates is None else candidates & ids
+        result = [book for i, book in books.items() if candidates is None or i in candidates]
+        if available_only:
+            result = [book for book in result if not book["isReserved"]]
+        return result[:limit]
+
+    def start(self) -> None:
+        """Загружает каталог и запускает фоновое обновление."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sber-catalog", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        self.refresh()
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+
+catalog = SberbankCatalog()
@@ -0,0 +1,149 @@
+import math
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+from service.sberbank_catalog import catalog as default_catalog
+
+# Вес поля при подсчете частоты терма: совпадение в названии важнее, чем в описании
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "author": 2.0,
+    "category": 1.5,
+    "description": 1.0,
+}
+
+# Окончания для облегченного стемминга русских слов
+RUSSIAN_ENDINGS = {
+    "иями", "ться", "ями", "ами", "ией", "иях", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ом", "ем", "ам", "ям",
+    "ах", "ях", "ых", "их", "ов", "ев", "ую", "юю", "ию", "ия", "ью", "ть", "ся",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+}
+ENDING_LENGTHS = sorted({len(ending) for ending in RUSSIAN_ENDINGS}, reverse=True)
+
+TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+
+@lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    """Отрезает самое длинное типичное окончание, оставляя основу не короче трех букв."""
+    if word.isascii():
+        return word[:-1] if len(word) > 4 and word.endswith("s") else word
+    for length in ENDING_LENGTHS:
+        if len(word) - length >= 3 and word[-length:] in RUSSIAN_ENDINGS:
+            return word[:-length]
+    return word
+
+
+def tokenize(text) -> list:
+    text = str(text or "").lower().replace("ё", "е")
+    return [stem(token) for token in TOKEN_RE.findall(text)]
+
+
+def trigrams(term: str) -> set:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SberbankSearchIndex:
+    """
+    Полнотекстовый поиск BM25 по каталогу библиотеки Сбербанка.
+
+    Индексирует название, автора, категорию и описание с весами полей и
+    облегченным русским стеммингом. Опечатки в запросе исправляются через
+    триграммный индекс словаря: неизвестное слово заменяется близкими
+    терминами каталога. Индекс перестраивается, когда меняется каталог.
+
+    Args:
+        catalog: Источник книг (по умолчанию общий SberbankCatalog).
+        k1, b: Параметры BM25.
+        min_similarity: Минимальное сходство триграмм для исправления опечатки.
+    """
+
+    def __init__(self, catalog=default_catalog, k1: float = 1.2, b: float = 0.75,
+                 min_similarity: float = 0.45):
+        self.catalog = catalog
+        self.k1 = k1
+        self.b = b
+        self.min_similarity = min_similarity
+        self._version = None
+        self._docs: list = []
+        self._postings: dict = {}
+        self._doc_lengths: list = []
+        self._avg_length = 0.0
+        self._trigram_index: dict = {}
+        self._lock = threading.Lock()
+        # Перестраиваем индекс сразу после обновления каталога, а не на первом запросе
+        catalog.on_update(self._ensure_index)
+
+    def _ensure_index(self) -> None:
+        self.catalog.ensure_fresh()
+        version = self.catalog.version
+        if self._version == version:
+            return
+        with self._lock:
+            if self._version != version:
+                self._build(self.catalog.books, version)
+
+    def _build(self, books: list, version) -> None:
+        postings, lengths = {}, []
+        for doc_id, book in enumerate(books):
+            frequencies = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(book.get(field)):
+                    frequencies[term] += weight
+            for term, tf in frequencies.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+            lengths.append(sum(frequencies.values()))
+        trigram_index = {}
+        for term in postings:
+            for gram in trigrams(term):
+                trigram_index.setdefault(gram, []).append(term)
+        self._docs, self._postings, self._doc_lengths = books, postings, lengths
+        self._avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        self._trigram_index = trigram_index
+        self._version = version
+
+    def _expand(self, term: str) -> list:
+        """Возвращает [(терм, вес)]: сам терм или похожие термы словаря при опечатке."""
+        if term in self._postings:
+            return [(term, 1.0)]
+        grams = trigrams(term)
+        shared = Counter(
+            candidate for gram in grams for candidate in self._trigram_index.get(gram, ())
+        )
+        similar = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams(candidate)) - count)
+            if similarity >= self.min_similarity:
+                similar.append((candidate, similarity))
+        similar.sort(key=lambda item: item[1], reverse=True)
+        return similar[:3]
+
+    def search(self, query: str, k: int = 5, available_only: bool = False) -> list:
+        """Возвращает до k книг, отсортированных по релевантности запросу."""
+        self._ensure_index()
+        total = len(self._docs)
+        if not total:
+            return []
+        scores = Counter()
+        for term in set(tokenize(query)):
+            for variant, weight in self._expand(term):
+                postings = self._postings[variant]
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings:
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / self._avg_length)
+                    scores[doc_id] += weight * idf * tf * (self.k1 + 1) / (tf + norm)
+        result = []
+        for doc_id, score in scores.most_common():
+            book = self._docs[doc_id]
+            if available_only and book["isReserved"]:
+                continue
+            result.append({**book, "score": round(score, 3)})
+            if len(result) == k:
+                break
+        return result
+
+
+search_index = SberbankSearchIndex()
@@ -0,0 +1,48 @@
+from dotenv import dotenv_values # type: ignore
+
+TRUE_VALUES = ("1", "true", "yes")
+
+
+class Settings:
+    """
+    Настройки бота из ``.env``, прочитанные один раз при импорте.
+
+    Модули берут свои параметры типизированными геттерами с умолчанием.
+    Пустое значение в ``.env`` считается незаданным, как и раньше с
+    ``config_dotenv.get(...) or default``.
+    """
+
+    def __init__(self, values: dict):
+        self._values = {key: value for key, value in values.items() if value}
+
+    @classmethod
+    def load(cls, path: str = ".env") -> "Settings":
+        return cls(dotenv_values(path))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._values
+
+    def get(self, name: str, default: str | None = None) -> str | None:
+        return self._values.get(name, default)
+
+    def _convert(self, name: str, default, cast):
+        value = self._values.get(name)
+        if value is None:
+            return default
+        try:
+            return cast(value)
+        except ValueError:
+            raise ValueError(f"{name} in .env must be {cast.__name__}, got {value!r}") from None
+
+    def get_int(self, name: str, default: int | None = None) -> int | None:
+        return self._convert(name, default, int)
+
+    def get_float(self, name: str, default: float | None = None) -> float | None:
+        return self._convert(name, default, float)
+
+    def get_bool(self, name: str, default: bool = False) -> bool:
+        value = self._values.get(name)
+        return default if value is None else value.lower() in TRUE_VALUES
+
+
+settings = Settings.load()
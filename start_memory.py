@@ -1,8 +1,5 @@
-from dotenv import dotenv_values # type: ignore
-from langgraph.checkpoint.postgres import PostgresSaver # type: ignore
+from llm.checkpointer import checkpointer_pool
 
-config = dotenv_values(".env")
-
-DB_URI = config.get("DB")
-with PostgresSaver.from_conn_string(DB_URI) as checkpointer:
-    checkpointer.setup()
\ No newline at end of file
+# Бот сам создает таблицы при старте, скрипт оставлен для ручного применения миграций
+checkpointer_pool.open()
+checkpointer_pool.close()